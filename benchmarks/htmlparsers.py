@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+# htmlparsers.py - benchmark for the HTML parser modules
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Compare the speed of the available HTML parser modules on generated
+pages of different sizes. Each page has a navigation menu and a number of
+paragraphs with links, images, anchors and inline styles.
+
+Run from the top-level directory with: python benchmarks/htmlparsers.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from webcheck.parsers import ParseResult
+
+
+def make_page(paragraphs):
+    """Return the (decoded) content of a page with the specified number
+    of paragraphs."""
+    parts = ['<html><head><title>Page &amp; title</title>'
+             '<meta name="author" content="Someone">'
+             '<link rel="stylesheet" href="/css/site.css"></head><body>'
+             '<ul id="menu">']
+    for i in range(20):
+        parts.append('<li><a href="/section%d/">Section %d</a></li>' % (i, i))
+    parts.append('</ul>')
+    for i in range(paragraphs):
+        parts.append(
+            '<div class="item" id="item%d"><h2><a name="p%d">Item %d</a></h2>'
+            '<p style="color: red">Some text with a <a href="page%d.html">'
+            'link</a> and an <img src="images/img%d.png" alt="image">.</p>'
+            '<p>More text that is <b>not</b> very <i>interesting</i>.</p>'
+            '</div>' % (i, i, i, i, i))
+    parts.append('<script src="/js/menu.js"></script></body></html>')
+    return u''.join(parts)
+
+
+def run(module, content, repeat=3):
+    """Return the time needed to parse the content."""
+    start = time.time()
+    for i in range(repeat):
+        module.parse(content, ParseResult('http://www.example.com/', True))
+    return (time.time() - start) / repeat
+
+
+def main():
+    modules = []
+    for name in ('lxmlparser', 'beautifulsoup', 'htmlparser'):
+        try:
+            modules.append(__import__('webcheck.parsers.html.' + name,
+                                      globals(), locals(), [name]))
+        except ImportError:
+            print '%s: not available' % name
+    for paragraphs in (10, 100, 1000):
+        content = make_page(paragraphs)
+        print '%d bytes:' % len(content)
+        for module in modules:
+            print '  %-14s %8.1f ms' % (module.__name__.split('.')[-1],
+                                       run(module, content) * 1000)
+
+
+if __name__ == '__main__':
+    main()
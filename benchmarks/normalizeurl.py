@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+# normalizeurl.py - microbenchmark for webcheck.myurllib.normalizeurl()
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Compare the speed of normalizeurl() with the plain normalisation
+function on the hrefs of a generated site. Every page of the site has the
+same navigation menu and a number of links to other pages, images and
+external sites, some of which are not in canonical form.
+
+Run from the top-level directory with: python benchmarks/normalizeurl.py
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from webcheck import myurllib
+
+
+def make_corpus(pages=500, seed=42):
+    """Return the list of hrefs as they would be found on all pages."""
+    rnd = random.Random(seed)
+    menu = ['/', '/about/', '/news/', '/products/', '/support/',
+            '/contact.html', 'index.html', '../index.html',
+            '/css/site.css', '/js/menu.js', '/images/logo.png',
+            'http://www.example.com/', 'https://www.example.com/login',
+            'http://WWW.Example.COM:80/sitemap.xml', '/search?q=&lang=en',
+            '/about/team.html#staff', 'mailto:info@example.com',
+            '/Products/Some%20Product.html', '/docs/%7Euser/notes.txt']
+    external = ['http://www.w3.org/', 'http://validator.w3.org/check?uri=referer',
+                'https://twitter.com/example', 'http://en.wikipedia.org/wiki/Web_crawler',
+                'http://Example.ORG/some/path/', 'https://github.com/example/project']
+    hrefs = []
+    for page in range(pages):
+        hrefs.extend(menu)
+        for i in range(20):
+            kind = rnd.random()
+            other = rnd.randrange(pages)
+            if kind < 0.5:
+                hrefs.append('/articles/%d/page-%d.html' % (other // 50, other))
+            elif kind < 0.7:
+                hrefs.append('images/photo%d.jpg' % rnd.randrange(1000))
+            elif kind < 0.8:
+                hrefs.append('/articles/%d/page %d.html#part%d' %
+                             (other // 50, other, i))
+            elif kind < 0.9:
+                hrefs.append('http://www.example.com/articles/%d/page-%d.html'
+                             % (other // 50, other))
+            else:
+                hrefs.append(rnd.choice(external))
+    return hrefs
+
+
+def run(function, hrefs):
+    """Return the time needed to normalise all hrefs."""
+    start = time.time()
+    for href in hrefs:
+        function(href)
+    return time.time() - start
+
+
+def main():
+    hrefs = make_corpus()
+    # check that the results are the same
+    for href in set(hrefs):
+        assert myurllib.normalizeurl(href) == myurllib._urlclean(href), href
+    myurllib._cache.clear()
+    plain = min(run(myurllib._urlclean, hrefs) for i in range(3))
+    cold = run(myurllib.normalizeurl, hrefs)
+    warm = min(run(myurllib.normalizeurl, hrefs) for i in range(3))
+    print '%d hrefs (%d unique)' % (len(hrefs), len(set(hrefs)))
+    print 'plain normalisation: %6.1f ms' % (plain * 1000)
+    print 'normalizeurl():      %6.1f ms (first run %.1f ms, %.1fx faster)' % (
+        warm * 1000, cold * 1000, plain / warm)
+
+
+if __name__ == '__main__':
+    main()
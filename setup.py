@@ -44,6 +44,7 @@ setup(
     extras_require={
         'tidy': ['utidylib'],
         'soup': ['beautifulsoup'],
+        'lxml': ['lxml'],
     },
     author='Arthur de Jong',
     author_email='arthur@arthurdejong.org',
@@ -0,0 +1,193 @@
+
+# cache.py - on-disk cache of retrieved documents
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""On-disk cache of retrieved documents. The information that was retrieved
+for a URL is kept in an index that is keyed by URL while the content itself
+is stored in a file that is named after the SHA-1 hash of the content so
+identical documents are only stored once."""
+
+import cPickle as pickle
+import hashlib
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# the properties of a FetchResult that are kept in the index
+_PROPERTIES = ('status', 'mimetype', 'encoding', 'size', 'transfer_size',
+               'mtime', 'etag', 'redirect', 'linkproblems', 'pageproblems')
+
+
+class ResponseCache(object):
+    """Cache of FetchResult objects in a directory.
+
+    Entries that are older than ttl seconds are not used (unless all
+    entries are requested to be used, e.g. when working offline). When the
+    cache is closed the least recently used entries are removed until the
+    stored content takes no more than max_size bytes."""
+
+    def __init__(self, directory, max_size=None, ttl=None):
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._index_file = os.path.join(directory, 'index')
+        # map of URL to dict with the stored properties, the digest of the
+        # content, whether the content was requested and timestamps
+        self._index = {}
+        try:
+            with open(self._index_file, 'rb') as fp:
+                self._index = pickle.load(fp)
+        except (IOError, EOFError, pickle.UnpicklingError), e:
+            logger.debug('not using cache index: %s', str(e))
+        # cache statistics
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, digest):
+        """Return the file name that is used for the content."""
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, url, result, parse=True, expired=False):
+        """Fill in the FetchResult with the information that was stored for
+        the URL. If parse is set the cached entry should have the content
+        (if it could be parsed). Returns False if there is no usable entry
+        in the cache."""
+        with self._lock:
+            entry = self._index.get(url)
+            if entry is None or (parse and not entry['parse']) or \
+               (not expired and self.ttl and
+                entry['stored'] + self.ttl < time.time()):
+                self.misses += 1
+                return False
+            entry['used'] = time.time()
+            self.hits += 1
+        content = None
+        if entry['digest']:
+            try:
+                with open(self._path(entry['digest']), 'rb') as fp:
+                    content = fp.read()
+            except IOError, e:
+                logger.debug('cached content missing: %s', str(e))
+                return False
+        for prop in _PROPERTIES:
+            setattr(result, prop, entry[prop])
+        result.content = content
+        result.digest = entry['digest']
+        return True
+
+    def put(self, result, parse=True):
+        """Store the FetchResult in the cache. The parse flag tells whether
+        the content was requested (it may still be None if the content
+        cannot be parsed). Problems writing the content (e.g. a full disk)
+        are logged and the result is not stored."""
+        entry = dict((prop, getattr(result, prop)) for prop in _PROPERTIES)
+        entry['parse'] = parse
+        entry['digest'] = None
+        if result.content is not None:
+            entry['digest'] = result.digest or \
+                hashlib.sha1(result.content).hexdigest()
+            path = self._path(entry['digest'])
+            # the same content may have been stored before
+            if not os.path.exists(path):
+                if not os.path.isdir(os.path.dirname(path)):
+                    try:
+                        os.makedirs(os.path.dirname(path))
+                    except OSError:
+                        # another thread may have created it
+                        pass
+                tmp = '%s.%s' % (path, threading.current_thread().ident)
+                try:
+                    with open(tmp, 'wb') as fp:
+                        fp.write(result.content)
+                    os.rename(tmp, path)
+                except EnvironmentError, e:
+                    logger.warn('cannot store %s in cache: %s',
+                                result.url, str(e))
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+                    return
+        entry['stored'] = entry['used'] = time.time()
+        with self._lock:
+            self._index[result.url] = entry
+
+    def _evict(self):
+        """Remove expired entries and the least recently used entries that
+        do not fit in the cache."""
+        now = time.time()
+        if self.ttl:
+            for url, entry in self._index.items():
+                if entry['stored'] + self.ttl < now:
+                    del self._index[url]
+        # find the size of the content that is referenced in the index
+        sizes = {}
+        for entry in self._index.itervalues():
+            if entry['digest'] and entry['digest'] not in sizes:
+                try:
+                    sizes[entry['digest']] = os.path.getsize(
+                        self._path(entry['digest']))
+                except OSError:
+                    sizes[entry['digest']] = 0
+        if self.max_size is not None:
+            total = sum(sizes.itervalues())
+            refs = {}
+            for entry in self._index.itervalues():
+                refs[entry['digest']] = refs.get(entry['digest'], 0) + 1
+            entries = sorted(self._index.items(),
+                             key=lambda x: x[1]['used'])
+            for url, entry in entries:
+                if total <= self.max_size:
+                    break
+                del self._index[url]
+                digest = entry['digest']
+                refs[digest] -= 1
+                if digest and not refs[digest]:
+                    total -= sizes.pop(digest)
+        # remove content files that are no longer referenced
+        for dirname in os.listdir(self.directory):
+            path = os.path.join(self.directory, dirname)
+            if not os.path.isdir(path):
+                continue
+            for filename in os.listdir(path):
+                if filename not in sizes:
+                    os.remove(os.path.join(path, filename))
+            if not os.listdir(path):
+                os.rmdir(path)
+
+    def close(self):
+        """Evict entries and write the index to disk."""
+        with self._lock:
+            self._evict()
+            logger.info('cache: %d hits, %d misses, %d entries',
+                        self.hits, self.misses, len(self._index))
+            tmp = self._index_file + '.tmp'
+            with open(tmp, 'wb') as fp:
+                pickle.dump(self._index, fp, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, self._index_file)
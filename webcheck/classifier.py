@@ -0,0 +1,131 @@
+
+# classifier.py - classification of URLs as internal, external or yanked
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Classification of URLs. This module determines whether URLs are part of
+the checked site and whether they should be checked at all based on the
+base URLs and the patterns from the command line. Everything that is needed
+for this is prepared once so classifying a URL is cheap."""
+
+import re
+import urlparse
+
+
+# the maximum number of URLs of which the classification is remembered
+_MEMO_SIZE = 100000
+
+# pattern for matching inline flags that apply to the whole expression
+_flags_re = re.compile(r'\(\?[iLmsux]+\)')
+
+
+def _compile(patterns):
+    """Return a list of compiled regular expressions that together match
+    the same URLs as the patterns. Patterns without groups are combined
+    into a single regular expression. Patterns with groups or flags are
+    kept separately because combining them would break back references or
+    change the meaning of the other patterns."""
+    simple = []
+    matchers = []
+    for pattern in patterns:
+        regexp = re.compile(pattern, re.IGNORECASE)
+        if regexp.groups or _flags_re.search(pattern):
+            matchers.append(regexp)
+        else:
+            simple.append(pattern)
+    if simple:
+        try:
+            matchers.insert(0, re.compile(
+                '|'.join('(?:%s)' % x for x in simple), re.IGNORECASE))
+        except (re.error, OverflowError, AssertionError):
+            # e.g. too many patterns to combine
+            matchers[0:0] = [re.compile(x, re.IGNORECASE) for x in simple]
+    return matchers
+
+
+def _search(matchers, url):
+    """Check whether any of the regular expressions matches the URL."""
+    for regexp in matchers:
+        if regexp.search(url) is not None:
+            return True
+    return False
+
+
+class UrlClassifier(object):
+    """Classify URLs as internal or external and determine whether they
+    should be yanked (not checked at all) based on the patterns.
+
+    URLs are internal if they match an internal pattern or otherwise if
+    they have the same host as (or with base_only start with) one of the
+    base URLs and do not match an external pattern."""
+
+    def __init__(self, base_urls, internal=(), external=(), yank=(),
+                 base_only=False, avoid_external=False):
+        self._internal = _compile(internal)
+        self._external = _compile(external)
+        self._yank = _compile(yank)
+        self._prefixes = tuple(base_urls)
+        self._netlocs = frozenset(urlparse.urlsplit(x)[1] for x in base_urls)
+        self._base_only = base_only
+        self._avoid_external = avoid_external
+        # map of URL to (is_internal, yanked) tuples
+        self._memo = {}
+
+    def _is_internal(self, url):
+        if _search(self._internal, url):
+            return True
+        if self._base_only:
+            # the url must start with one of the base URLs
+            if not url.startswith(self._prefixes):
+                return False
+        else:
+            # the netloc must match a netloc of a base URL
+            if urlparse.urlsplit(url)[1] not in self._netlocs:
+                return False
+        return not _search(self._external, url)
+
+    def classify(self, url):
+        """Return a (is_internal, yanked) tuple for the URL where yanked is
+        the reason why the URL should not be checked or None."""
+        try:
+            return self._memo[url]
+        except KeyError:
+            pass
+        is_internal = self._is_internal(url)
+        yanked = None
+        if _search(self._yank, url):
+            yanked = 'yanked'
+        elif not is_internal and self._avoid_external:
+            yanked = 'external avoided'
+        if len(self._memo) >= _MEMO_SIZE:
+            self._memo.clear()
+        self._memo[url] = (is_internal, yanked)
+        return is_internal, yanked
+
+    def classify_all(self, urls):
+        """Classify all the URLs (e.g. the links on a page) at once. This
+        returns a dict mapping each URL to a (is_internal, yanked)
+        tuple."""
+        classify = self.classify
+        return dict((url, classify(url)) for url in set(urls))
+
+    def is_internal(self, url):
+        """Check whether the URL is internal."""
+        return self.classify(url)[0]
@@ -96,6 +96,19 @@ parser.add_argument(
 parser.add_argument(
     '-c', '--continue', action='store_true',
     help='try to continue from a previous run')
+parser.add_argument(
+    '--revalidate', action='store_true',
+    help='check the site of a previous run again, only downloading modified documents')
+parser.add_argument(
+    '--commit-links', metavar='N', type=int,
+    help='write to the database after every N links')
+parser.add_argument(
+    '--commit-interval', metavar='SECONDS', type=float,
+    help='write to the database at least every SECONDS')
+parser.add_argument(
+    '--db-profile', metavar='PROFILE',
+    choices=('default', 'fast', 'ephemeral'),
+    help='the database settings to use: default, fast or ephemeral')
 parser.add_argument(
     '-f', '--force', action='store_true',
     help='overwrite files without asking')
@@ -107,7 +120,68 @@ parser.add_argument(
     help='maximum depth of links to follow from base urls')
 parser.add_argument(
     '-w', '--wait', metavar='SECONDS', type=float,
-    help='wait SECONDS between retrievals')
+    help='wait SECONDS between retrievals from the same host')
+parser.add_argument(
+    '--bandwidth', metavar='KB', type=int,
+    help='download at most KB kilobytes per second')
+parser.add_argument(
+    '--head', action='store_true',
+    help='use HEAD requests for external URLs and content that is not parsed')
+parser.add_argument(
+    '--max-size', metavar='KB', type=int,
+    help='only download the first KB kilobytes of a document')
+parser.add_argument(
+    '--cache', action='store_true',
+    help='keep a cache of retrieved documents in the output directory')
+parser.add_argument(
+    '--cache-size', metavar='MB', type=int,
+    help='the maximum size of the documents in the cache')
+parser.add_argument(
+    '--cache-ttl', metavar='SECONDS', type=int,
+    help='retrieve cached documents again after SECONDS')
+parser.add_argument(
+    '--offline', action='store_true',
+    help='only use documents from the cache instead of retrieving them')
+parser.add_argument(
+    '--no-keep-alive', dest='keep_alive', action='store_false',
+    help='open a new connection for every request')
+parser.add_argument(
+    '-t', '--threads', metavar='N', type=int,
+    help='use N threads for retrieving URLs')
+parser.add_argument(
+    '--external-threads', metavar='N', type=int,
+    help='use N separate threads for checking external URLs')
+parser.add_argument(
+    '--host-connections', metavar='N', type=int,
+    help='the maximum number of simultaneous connections to a single host')
+parser.add_argument(
+    '--parse-processes', metavar='N', type=int,
+    help='use N processes for parsing retrieved documents')
+parser.add_argument(
+    '--parser', metavar='PARSER',
+    choices=('lxml', 'beautifulsoup', 'htmlparser'),
+    help='the HTML parser to use: lxml, beautifulsoup or htmlparser')
+parser.add_argument(
+    '--stream', action='store_true',
+    help='parse HTML documents while they are being retrieved')
+parser.add_argument(
+    '--max-parse-time', metavar='SECONDS', type=int,
+    help='stop parsing a document after SECONDS')
+parser.add_argument(
+    '--max-elements', metavar='N', type=int,
+    help='stop parsing a document after N elements')
+parser.add_argument(
+    '--max-links', metavar='N', type=int,
+    help='ignore links after the first N links of a document')
+parser.add_argument(
+    '--max-inline-css', metavar='KB', type=int,
+    help='ignore inline CSS after the first KB kilobytes of a document')
+parser.add_argument(
+    '--validate', metavar='MODE', choices=('off', 'inline', 'background'),
+    help='validate pages with tidy: off, inline or background')
+parser.add_argument(
+    '--validate-processes', metavar='N', type=int,
+    help='use N processes for validating pages in the background')
 parser.add_argument(
     '--profile', action='store_true', help=argparse.SUPPRESS)
 parser.add_argument(
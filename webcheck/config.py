@@ -46,10 +46,117 @@ OUTPUT_DIR = '.'
 # Whether to try to read a state file to continue from.
 CONTINUE = False
 
-# This is the time in seconds to wait between requests. This is the state of
-# the -w command line option.
+# Whether to check the site of a previous run again, only downloading
+# modified documents. This is the state of the --revalidate command line
+# option.
+REVALIDATE = False
+
+# This is the time in seconds to wait between requests to the same host. A
+# larger delay may be set with Crawl-delay in the robots.txt file of the
+# host. This is the state of the -w command line option.
 WAIT_BETWEEN_REQUESTS = 0
 
+# The maximum number of kilobytes per second that are downloaded (None means
+# no limit). This is the state of the --bandwidth command line option.
+BANDWIDTH = None
+
+# The maximum number of seconds a server may ask to wait with a Retry-After
+# header (with a 429 or 503 response) for the request to be tried again.
+MAX_RETRY_AFTER = 120
+
+# The number of threads that are used for retrieving URLs concurrently. This
+# is the state of the -t command line option.
+THREADS = 1
+
+# The number of extra threads that are used for checking external URLs. If
+# this is 0 external URLs are retrieved by the normal threads. This is the
+# state of the --external-threads command line option.
+EXTERNAL_THREADS = 0
+
+# The maximum number of simultaneous connections to a single host when using
+# multiple threads. This is the state of the --host-connections command line
+# option.
+HOST_CONNECTIONS = 2
+
+# The number of processes that are used for parsing retrieved documents. If
+# this is 1 documents are parsed by the crawling thread. This is the state of
+# the --parse-processes command line option.
+PARSE_PROCESSES = 1
+
+# The parser that is used for HTML documents: lxml, beautifulsoup or
+# htmlparser. If this is None the first of these that is available is used.
+# This is the state of the --parser command line option.
+HTML_PARSER = None
+
+# Whether HTML documents are parsed while they are being retrieved instead
+# of after the whole document has been read. This is only supported by the
+# lxml and htmlparser parsers. This is the state of the --stream command
+# line option.
+STREAM_PARSING = False
+
+# The limits for parsing a single document: the maximum number of seconds
+# spent on parsing, the maximum number of elements, the maximum number of
+# links and the maximum number of kilobytes of inline CSS (0 means no limit).
+# Parsing stops or the rest is ignored when a limit is reached and this is
+# reported as a page problem. These are the states of the --max-parse-time,
+# --max-elements, --max-links and --max-inline-css command line options.
+MAX_PARSE_TIME = 0
+MAX_ELEMENTS = 0
+MAX_LINKS = 0
+MAX_INLINE_CSS = 0
+
+# Whether to use HEAD requests for external URLs and for URLs of which the
+# content cannot be parsed. This is the state of the --head command line
+# option.
+HEAD_REQUESTS = False
+
+# The maximum number of kilobytes that are downloaded of a single document
+# (None means no limit). This is the state of the --max-size command line
+# option.
+MAX_SIZE = None
+
+# Whether to keep a cache of retrieved documents in the output directory.
+# This is the state of the --cache command line option.
+CACHE = False
+
+# The maximum size of the documents in the cache in megabytes (None means no
+# limit). This is the state of the --cache-size command line option.
+CACHE_SIZE = 100
+
+# The number of seconds after which cached documents are retrieved again
+# (None means they do not expire). This is the state of the --cache-ttl
+# command line option.
+CACHE_TTL = None
+
+# Whether to only use documents from the cache instead of retrieving them.
+# This is the state of the --offline command line option.
+OFFLINE = False
+
+# Whether to keep HTTP connections open to reuse them for further requests
+# to the same host. This is the inverse of the --no-keep-alive command line
+# option.
+KEEP_ALIVE = True
+
+# The number of seconds an idle connection is kept open.
+KEEP_ALIVE_TIMEOUT = 15
+
+# The maximum number of idle connections that are kept open per host.
+KEEP_ALIVE_POOL_SIZE = 4
+
+# The number of links after which the information is written to the database
+# and the maximum number of seconds between writes. If webcheck is stopped
+# unexpectedly at most this many links have to be retrieved again when
+# continuing. These are the states of the --commit-links and
+# --commit-interval command line options.
+COMMIT_LINKS = 50
+COMMIT_INTERVAL = 10
+
+# The SQLite settings that are used for the database: default, fast (uses
+# WAL and less syncing to disk) or ephemeral (keeps the database in memory and
+# writes it to disk at the end). This is the state of the --db-profile command
+# line option.
+DB_PROFILE = 'default'
+
 # Maximum number of links to follow from the specified base URLs.
 MAX_DEPTH = None
 
@@ -111,3 +218,13 @@ TIDY_OPTIONS = dict(quiet=1,
                     show_errors=6,
                     show_warnings=1,
                     char_encoding='utf8')
+
+# How pages are validated with tidy: off, inline (while parsing the page) or
+# background (in separate processes while crawling continues). This is the
+# state of the --validate command line option.
+VALIDATE = 'inline'
+
+# The number of processes that are used for validating pages in the
+# background (None means the number of processors). This is the state of the
+# --validate-processes command line option.
+VALIDATE_PROCESSES = None
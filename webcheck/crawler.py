@@ -27,9 +27,8 @@ containing the state for the crawled site and some functions to access and
 manipulate the crawling of the website. This module also contains the Link
 class that holds all the link related properties."""
 
-import atexit
-import cookielib
 import datetime
+import heapq
 import httplib
 import logging
 import os
@@ -37,55 +36,29 @@ import re
 import robotparser
 import time
 import urllib
-import urllib2
 import urlparse
 
+from sqlalchemy import func
+from sqlalchemy.sql.expression import select
+
 from webcheck import config
-from webcheck.db import Session, Link, setup_db, truncate_db
+from webcheck.classifier import UrlClassifier
+from webcheck.db import Session, Link, LinkProblem, PageProblem, Anchor, \
+                        RequestedAnchor, children, embedded, link_index, \
+                        setup_db, truncate_db
+from webcheck.fetcher import setup_urllib2, close_connections, \
+                             setup_cache, close_cache, read_robots, \
+                             setup_rate_limiter, \
+                             InlineFetcher, FetcherPool
 from webcheck.output import install_file
-import webcheck.parsers
+from webcheck.parsers import InlineParser, ParserPool, ParseMemo
+import webcheck.parsers.html
+from webcheck.validator import get_validator
 
 
 logger = logging.getLogger(__name__)
 
 
-class RedirectError(urllib2.HTTPError):
-
-    def __init__(self, url, code, msg, hdrs, fp, newurl):
-        self.newurl = newurl
-        urllib2.HTTPError.__init__(self, url, code, msg, hdrs, fp)
-
-
-class NoRedirectHandler(urllib2.HTTPRedirectHandler):
-
-    def redirect_request(self, req, fp, code, msg, headers, newurl):
-        raise RedirectError(req.get_full_url(), code, msg, headers, fp, newurl)
-
-
-def _setup_urllib2():
-    """Configure the urllib2 module to store cookies in the output
-    directory."""
-    import webcheck  # local import to avoid import loop
-    filename = os.path.join(config.OUTPUT_DIR, 'cookies.txt')
-    # set up our cookie jar
-    cookiejar = cookielib.MozillaCookieJar(filename)
-    try:
-        cookiejar.load(ignore_discard=False, ignore_expires=False)
-    except IOError:
-        pass
-    atexit.register(cookiejar.save, ignore_discard=False, ignore_expires=False)
-    # set up our custom opener that sets a meaningful user agent
-    opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(cookiejar),
-                                  NoRedirectHandler())
-    opener.addheaders = [
-      ('User-agent', 'webcheck %s' % webcheck.__version__),
-      ]
-    if config.BYPASSHTTPCACHE:
-        opener.addheaders.append(('Cache-control', 'no-cache'))
-        opener.addheaders.append(('Pragma', 'no-cache'))
-    urllib2.install_opener(opener)
-
-
 # pattern for matching spaces
 _spacepattern = re.compile(' ')
 
@@ -99,10 +72,63 @@ default_cfg = dict(
     avoid_external=config.AVOID_EXTERNAL_LINKS, ignore_robots=not(config.USE_ROBOTS),
     output=config.OUTPUT_DIR, force=config.OVERWRITE_FILES,
     redirects=config.REDIRECT_DEPTH, max_depth=config.MAX_DEPTH,
-    wait=config.WAIT_BETWEEN_REQUESTS)
+    wait=config.WAIT_BETWEEN_REQUESTS, head=config.HEAD_REQUESTS,
+    max_size=config.MAX_SIZE, revalidate=config.REVALIDATE,
+    cache=config.CACHE, cache_size=config.CACHE_SIZE,
+    cache_ttl=config.CACHE_TTL, offline=config.OFFLINE,
+    bandwidth=config.BANDWIDTH, commit_links=config.COMMIT_LINKS,
+    commit_interval=config.COMMIT_INTERVAL, db_profile=config.DB_PROFILE,
+    keep_alive=config.KEEP_ALIVE, threads=config.THREADS,
+    external_threads=config.EXTERNAL_THREADS,
+    host_connections=config.HOST_CONNECTIONS,
+    parse_processes=config.PARSE_PROCESSES, parser=config.HTML_PARSER,
+    stream=config.STREAM_PARSING, max_parse_time=config.MAX_PARSE_TIME,
+    max_elements=config.MAX_ELEMENTS, max_links=config.MAX_LINKS,
+    max_inline_css=config.MAX_INLINE_CSS, validate=config.VALIDATE,
+    validate_processes=config.VALIDATE_PROCESSES)
 default_cfg.update({'continue': config.CONTINUE})
 
 
+class Frontier(object):
+    """The links that are waiting to be fetched. Links are handed out in
+    order of depth and internal links are handed out before external links
+    of the same depth. A link is only added once.
+
+    Internal and external links are kept separately so links can be taken
+    for only one of the fetcher lanes.
+
+    Each entry holds the id, URL, depth and referer of the link."""
+
+    def __init__(self):
+        # per external flag a heap of entries
+        self._heaps = {False: [], True: []}
+        self._seen = set()
+        self._counter = 0
+
+    def __len__(self):
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def add(self, link_id, url, depth, is_internal, referer=None):
+        """Add the link if it was not added before."""
+        if url in self._seen:
+            return
+        self._seen.add(url)
+        # the counter keeps links of the same priority in order of discovery
+        self._counter += 1
+        heapq.heappush(self._heaps[not is_internal],
+                       (depth or 0, not is_internal, self._counter, link_id,
+                        url, referer))
+
+    def pop(self, external=(False, True)):
+        """Return a (link_id, referer) tuple for the next link or None if
+        there are no more links. The external argument lists which kinds of
+        links (False for internal and True for external) may be returned."""
+        heaps = [self._heaps[x] for x in external if self._heaps[x]]
+        if heaps:
+            entry = heapq.heappop(min(heaps, key=lambda heap: heap[0]))
+            return entry[3], entry[5]
+
+
 class Config(object):
 
     def __init__(self, *args, **kwargs):
@@ -130,28 +156,40 @@ class Crawler(object):
         # complete the configuration
         self.cfg = Config(default_cfg)
         self.cfg.update(cfg)
-        # list of regexps considered internal
-        self._internal_res = {}
-        for pattern in self.cfg.internal:
-            self._internal_res[pattern] = re.compile(pattern, re.IGNORECASE)
-        # list of regexps considered external
-        self._external_res = {}
-        for pattern in self.cfg.external:
-            self._external_res[pattern] = re.compile(pattern, re.IGNORECASE)
-        # list of regexps matching links that should not be checked
-        self._yanked_res = {}
-        for pattern in self.cfg.yank:
-            self._yanked_res[pattern] = re.compile(pattern, re.IGNORECASE)
         # update other configuration
         config.BASE_URLS_ONLY = self.cfg.base_only
         config.AVOID_EXTERNAL_LINKS = self.cfg.avoid_external
         config.USE_ROBOTS = not(self.cfg.ignore_robots)
         config.OUTPUT_DIR = self.cfg.output_dir
         config.CONTINUE = getattr(self.cfg, 'continue')
+        config.REVALIDATE = self.cfg.revalidate
         config.OVERWRITE_FILES = self.cfg.force
         config.REDIRECT_DEPTH = self.cfg.redirects
         config.MAX_DEPTH = self.cfg.max_depth
         config.WAIT_BETWEEN_REQUESTS = self.cfg.wait
+        config.BANDWIDTH = self.cfg.bandwidth
+        config.HEAD_REQUESTS = self.cfg.head
+        config.MAX_SIZE = self.cfg.max_size
+        config.CACHE = self.cfg.cache
+        config.CACHE_SIZE = self.cfg.cache_size
+        config.CACHE_TTL = self.cfg.cache_ttl
+        config.OFFLINE = self.cfg.offline
+        config.KEEP_ALIVE = self.cfg.keep_alive
+        config.COMMIT_LINKS = self.cfg.commit_links
+        config.COMMIT_INTERVAL = self.cfg.commit_interval
+        config.DB_PROFILE = self.cfg.db_profile
+        config.THREADS = self.cfg.threads
+        config.EXTERNAL_THREADS = self.cfg.external_threads
+        config.HOST_CONNECTIONS = self.cfg.host_connections
+        config.PARSE_PROCESSES = self.cfg.parse_processes
+        config.HTML_PARSER = self.cfg.parser
+        config.STREAM_PARSING = self.cfg.stream
+        config.MAX_PARSE_TIME = self.cfg.max_parse_time
+        config.MAX_ELEMENTS = self.cfg.max_elements
+        config.MAX_LINKS = self.cfg.max_links
+        config.MAX_INLINE_CSS = self.cfg.max_inline_css
+        config.VALIDATE = self.cfg.validate
+        config.VALIDATE_PROCESSES = self.cfg.validate_processes
         # map of scheme+netloc to robot parsers
         self._robotparsers = {}
         # set up empty site name
@@ -170,6 +208,10 @@ class Crawler(object):
             url = Link.clean_url(url)
             if url not in self.base_urls:
                 self.base_urls.append(url)
+        # set up the classification of URLs
+        self._classifier = UrlClassifier(
+            self.base_urls, self.cfg.internal, self.cfg.external,
+            self.cfg.yank, config.BASE_URLS_ONLY, config.AVOID_EXTERNAL_LINKS)
         # set up empty site name
         self.site_name = None
 
@@ -180,28 +222,12 @@ class Crawler(object):
         if not os.path.isdir(config.OUTPUT_DIR):
             os.mkdir(config.OUTPUT_DIR)
         filename = os.path.join(config.OUTPUT_DIR, 'webcheck.sqlite')
-        setup_db(filename)
+        setup_db(filename, config.DB_PROFILE)
 
     def _is_internal(self, url):
         """Check whether the specified url is external or internal. This
-        uses the urls marked with add_base() and the regular expressions
-        passed with add_external_re()."""
-        for regexp in self._internal_res.values():
-            if regexp.search(url) is not None:
-                return True
-        if config.BASE_URLS_ONLY:
-            # the url must start with one of the base URLs
-            if not any(url.startswith(x) for x in self.base_urls):
-                return False
-        else:
-            # the netloc must match a netloc of an _internal_url
-            netloc = urlparse.urlsplit(url)[1]
-            if not any((urlparse.urlsplit(x)[1] == netloc) for x in self.base_urls):
-                return False
-        for x in self._external_res.values():
-            if x.search(url):
-                return False
-        return True
+        uses the base URLs and the internal and external patterns."""
+        return self._classifier.is_internal(url)
 
     def _get_robotparser(self, scheme, netloc):
         """Return the proper robots parser for the given url or None if one
@@ -221,7 +247,7 @@ class Crawler(object):
                 rp = robotparser.RobotFileParser()
                 rp.set_url(urlparse.urlunsplit(
                   (scheme, netloc, '/robots.txt', '', '')))
-                rp.read()
+                read_robots(rp)
                 self._robotparsers[location] = rp
             except (TypeError, IOError, httplib.HTTPException):
                 # ignore any problems setting up robot parser
@@ -230,17 +256,11 @@ class Crawler(object):
 
     def _is_yanked(self, url):
         """Check whether the specified url should not be checked at all.
-        This uses the regualr expressions passed with add_yanked_re() and the
-        robots information present."""
-        # check if it is yanked through the regexps
-        for regexp in self._yanked_res.values():
-            # if the url matches it is yanked and we can stop
-            if regexp.search(url):
-                return 'yanked'
-        # check if we should avoid external links
-        is_internal = self._is_internal(url)
-        if not is_internal and config.AVOID_EXTERNAL_LINKS:
-            return 'external avoided'
+        This uses the yank patterns and the robots information present."""
+        # check the yank patterns and whether we should avoid external links
+        is_internal, yanked = self._classifier.classify(url)
+        if yanked:
+            return yanked
         # check if we should use robot parsers
         if not config.USE_ROBOTS:
             return None
@@ -268,6 +288,46 @@ class Crawler(object):
             links = links.filter(Link.depth <= config.MAX_DEPTH)
         return links.filter(Link.yanked == None)
 
+    def _add_to_frontier(self, link, referer=None, is_internal=None):
+        """Add the link to the links that should be fetched."""
+        if link.fetched or link.yanked:
+            return
+        if config.MAX_DEPTH != None and link.depth > config.MAX_DEPTH:
+            return
+        if is_internal is None:
+            is_internal = self._is_internal(link.url)
+        self._frontier.add(link.id, link.url, link.depth, is_internal,
+                           referer)
+
+    def _add_children_to_frontier(self, link):
+        """Add the links that were found in the link to the frontier."""
+        found = link.children.filter(Link.fetched == None).all() + \
+                link.embedded.filter(Link.fetched == None).all()
+        if not found:
+            return
+        classes = self._classifier.classify_all(x.url for x in found)
+        for child in found:
+            self._add_to_frontier(child, link.url, classes[child.url][0])
+
+    def _next_link(self, session, fetcher):
+        """Return the next link that should be fetched together with the
+        referer or None if there are no more links to fetch at this moment.
+        Only links for which the fetcher has room are returned. The link is
+        marked as fetched when the result is stored."""
+        while True:
+            external = [x for x in (False, True) if fetcher.has_room(x)]
+            entry = self._frontier.pop(external)
+            if entry is None:
+                return None
+            link_id, referer = entry
+            link = session.query(Link).get(link_id)
+            link.is_internal = self._is_internal(link.url)
+            link.yanked = self._is_yanked(str(link.url))
+            # skip link it there is nothing to check
+            if link.yanked or link.fetched:
+                continue
+            return link, referer
+
     def crawl(self):
         """Crawl the website based on the urls specified with add_base().
         If the serialization file pointer is specified the crawler writes
@@ -275,123 +335,257 @@ class Crawler(object):
         # connect to the database
         self.setup_database()
         # configure urllib2 to store cookies in the output directory
-        _setup_urllib2()
+        setup_urllib2()
+        setup_cache()
+        setup_rate_limiter()
         # get a database session
         session = Session()
         # remove all links
-        if not config.CONTINUE:
+        if config.REVALIDATE:
+            self._prepare_revalidation(session)
+        elif not config.CONTINUE:
             truncate_db()
+        if config.CONTINUE or config.REVALIDATE:
+            link_index.load(session)
         # add all internal urls to the database
+        self._frontier = Frontier()
         for url in self.base_urls:
-            self._get_link(session, url)
-        # add some URLs from the database that haven't been fetched
-        tocheck = self._get_links_to_crawl(session)
-        remaining = tocheck.count()
-        tocheck = tocheck[:100]
-        remaining -= len(tocheck)
-        # repeat until we have nothing more to check
-        while tocheck:
-            # choose a link from the tocheck list
-            link = tocheck.pop()
-            link.is_internal = self._is_internal(link.url)
-            link.yanked = self._is_yanked(str(link.url))
-            # see if there are any more links to check
-            if not tocheck:
-                tocheck = self._get_links_to_crawl(session)
-                remaining = tocheck.count()
-                tocheck = tocheck[:100]
-                remaining -= len(tocheck)
-            # skip link it there is nothing to check
-            if link.yanked or link.fetched:
-                continue
-            # fetch the link's contents
-            response = self._fetch_link(link)
-            if response:
-                self._parse_response(link, response)
-            # flush database changes
-            session.commit()
-            # sleep between requests if configured
-            if config.WAIT_BETWEEN_REQUESTS > 0:
-                logger.debug('sleeping %s seconds',
-                             config.WAIT_BETWEEN_REQUESTS)
-                time.sleep(config.WAIT_BETWEEN_REQUESTS)
-            logger.debug('items left to check: %d' %
-                          (remaining + len(tocheck)))
+            self._add_to_frontier(self._get_link(session, url))
+        # pick up the links that were not fetched in a previous run
+        if config.CONTINUE:
+            for link in self._get_links_to_crawl(session):
+                parent = link.parents.first()
+                self._add_to_frontier(link, parent.url if parent else None)
+        # set up the parsers (before starting any threads)
+        if config.PARSE_PROCESSES > 1:
+            parser = ParserPool(config.PARSE_PROCESSES)
+        else:
+            parser = InlineParser()
+        validator = get_validator()
+        memo = ParseMemo()
+        # set up the fetchers
+        if config.THREADS > 1 or config.EXTERNAL_THREADS > 0:
+            fetcher = FetcherPool(config.THREADS, config.HOST_CONNECTIONS,
+                                  config.EXTERNAL_THREADS)
+        else:
+            fetcher = InlineFetcher()
+        # keep track of changes that have not been committed
+        uncommitted = 0
+        last_commit = time.time()
+        # whether a link is being stored (the session is inconsistent)
+        storing = False
+        try:
+            # repeat until we have nothing more to check
+            while True:
+                # hand out links to the fetchers while they have room
+                while parser.has_room():
+                    entry = self._next_link(session, fetcher)
+                    if entry is None:
+                        break
+                    link, referer = entry
+                    validators = {}
+                    if config.REVALIDATE:
+                        validators = dict(etag=link.etag, mtime=link.mtime)
+                    fetcher.submit(link.id, link.url,
+                                   referer=referer,
+                                   external=not link.is_internal,
+                                   **validators)
+                # collect parsed documents, waiting for them if nothing
+                # else can be done
+                if parser.active() and (parser.ready() or
+                                        not parser.has_room() or
+                                        not fetcher.active()):
+                    (link_id, result), parsed = parser.get()
+                    link = session.query(Link).get(link_id)
+                    memo.put(self._memo_key(link, result), parsed)
+                # stop if nothing is being fetched any more
+                elif not fetcher.active():
+                    break
+                else:
+                    link_id, result = fetcher.get()
+                    link = session.query(Link).get(link_id)
+                    key = self._memo_key(link, result)
+                    # the content may have been parsed while it was retrieved
+                    parsed = result.parsed
+                    if parsed is not None:
+                        memo.put(key, parsed)
+                    else:
+                        # content that was seen before is not parsed again
+                        parsed = memo.get(key, link.url)
+                    # have the content parsed before storing anything
+                    if parsed is None and result.status != '304' and \
+                       result.content is not None:
+                        parser.submit((link_id, result), result.content,
+                                      result.mimetype, link.url,
+                                      link.is_internal, result.encoding)
+                        continue
+                # store the retrieved information in the database
+                storing = True
+                self._store_result(session, link, result, parsed)
+                self._add_children_to_frontier(link)
+                if validator:
+                    # have internal pages validated in the background
+                    if link.is_internal and result.content is not None and \
+                       result.mimetype in webcheck.parsers.html.mimetypes:
+                        # limit the number of pages waiting in memory
+                        while not validator.has_room():
+                            self._store_validated(session, [validator.get()])
+                        validator.submit(link.id, result.content,
+                                         link.encoding)
+                    self._store_validated(session, validator.results())
+                storing = False
+                # commit database changes every once in a while
+                uncommitted += 1
+                if uncommitted >= config.COMMIT_LINKS or \
+                   time.time() - last_commit >= config.COMMIT_INTERVAL:
+                    logger.debug('committing %d links', uncommitted)
+                    session.commit()
+                    uncommitted = 0
+                    last_commit = time.time()
+                logger.debug('items left to check: %d' %
+                              (len(self._frontier) + fetcher.active()))
+            # wait for the validation of the remaining pages
+            if validator:
+                logger.debug('waiting for %d pages to be validated',
+                             validator.active())
+                self._store_validated(session, validator.results(wait=True))
+            self._store_duplicates(session, memo)
+        except KeyboardInterrupt:
+            if storing:
+                # a partially stored link would not be fetched again when
+                # continuing so drop everything since the last commit
+                session.rollback()
+            else:
+                # keep what has been stored so far to be able to continue
+                self._store_duplicates(session, memo)
+                session.commit()
+            raise
+        finally:
+            fetcher.close()
+            parser.close()
+            if validator:
+                validator.close()
+            close_connections()
+            close_cache()
+        if config.REVALIDATE:
+            self._remove_stale_links(session)
         session.commit()
         session.close()
 
-    def _fetch_link(self, link):
-        """Attempt to fetch the url and return content. This updates the
-        link with information retrieved."""
-        logger.info(link.url)
-        # mark the link as fetched to avoid loops
+    def _prepare_revalidation(self, session):
+        """Prepare the database of a previous run for checking the site
+        again. Only links that are found again while crawling are fetched,
+        using conditional requests to avoid downloading unmodified
+        content."""
+        self._started = datetime.datetime.now()
+        # problems retrieving links are determined again
+        session.query(LinkProblem).delete()
+        # start with fetching the base URLs again
+        session.query(Link).filter(Link.url.in_(self.base_urls)).update(
+            dict(fetched=None), synchronize_session=False)
+        session.commit()
+
+    def _clear_link(self, session, link):
+        """Remove the information of a previous run that is determined
+        again when a modified link is parsed."""
+        session.execute(children.delete().where(
+            children.c.parent_id == link.id))
+        session.execute(embedded.delete().where(
+            embedded.c.parent_id == link.id))
+        session.query(Anchor).filter(Anchor.link_id == link.id).delete()
+        session.query(RequestedAnchor).filter(
+            RequestedAnchor.parent_id == link.id).delete()
+        session.query(PageProblem).filter(
+            PageProblem.link_id == link.id).delete()
+        link.encoding = link.title = link.author = link.is_page = None
+        link.etag = link.mtime = None
+        link.redirectdepth = 0
+
+    def _revalidate_children(self, session, link):
+        """Mark the links that are found on the page and were fetched in
+        a previous run for fetching again."""
+        session.flush()
+        child_ids = session.query(children.c.child_id).filter(
+            children.c.parent_id == link.id).union(
+                session.query(embedded.c.child_id).filter(
+                    embedded.c.parent_id == link.id))
+        session.query(Link).filter(Link.id.in_(child_ids)).filter(
+            Link.fetched < self._started).update(
+                dict(fetched=None), synchronize_session='fetch')
+
+    def _remove_stale_links(self, session):
+        """Remove the links of a previous run that were not found again."""
+        stale = select([Link.id]).where(Link.fetched < self._started)
+        logger.debug('removing links that were not found again')
+        for table in (children, embedded):
+            session.execute(table.delete().where(
+                table.c.parent_id.in_(stale) | table.c.child_id.in_(stale)))
+        for cls in (LinkProblem, PageProblem, Anchor):
+            session.execute(cls.__table__.delete().where(
+                cls.link_id.in_(stale)))
+        session.execute(RequestedAnchor.__table__.delete().where(
+            RequestedAnchor.link_id.in_(stale) |
+            RequestedAnchor.parent_id.in_(stale)))
+        session.execute(Link.__table__.delete().where(Link.id.in_(stale)))
+
+    def _memo_key(self, link, result):
+        """Return the key under which the ParseResult of the retrieved
+        content is remembered or None if it should not be remembered."""
+        if result.digest and result.size and result.status != '304':
+            return (result.digest, result.mimetype, result.encoding,
+                    link.is_internal)
+
+    def _store_result(self, session, link, result, parsed=None):
+        """Update the link with the information from the FetchResult and
+        the ParseResult of the retrieved content."""
+        if config.REVALIDATE:
+            if result.status != '304':
+                self._clear_link(session, link)
+            self._store_fetched(link, result, parsed)
+            self._revalidate_children(session, link)
+        else:
+            self._store_fetched(link, result, parsed)
+
+    def _store_fetched(self, link, result, parsed=None):
+        """Update the link with the information from the FetchResult and
+        the ParseResult of the retrieved content."""
         link.fetched = datetime.datetime.now()
-        # see if we can import the proper module for this scheme
-        try:
-            # FIXME: if an URI has a username:passwd add the uri, username and password to the HTTPPasswordMgr
-            request = urllib2.Request(link.url)
-            parent = link.parents.first()
-            if parent:
-                request.add_header('Referer', parent.url)
-            response = urllib2.urlopen(request, timeout=config.IOTIMEOUT)
-            info = response.info()
-            link.mimetype = info.gettype()
-            link.set_encoding(response.headers.getparam('charset'))
-            # get result code and other stuff
-            link.status = str(response.code)
-            try:
-                link.size = int(info.getheader('Content-length'))
-            except (TypeError, ValueError):
-                pass
-            mtime = info.getdate('Last-Modified')
-            if mtime:
-                link.mtime = datetime.datetime(*mtime[:7])
-            # if response.status == 301: link.add_linkproblem(str(response.status)+': '+response.reason)
-            # elif response.status != 200: link.add_linkproblem(str(response.status)+': '+response.reason)
-            # TODO: add checking for size
-            return response
-        except RedirectError, e:
-            link.status = str(e.code)
-            logger.info(str(e))
-            if e.code == 301:
-                link.add_linkproblem(str(e))
-            link.add_redirect(e.newurl)
-        except urllib2.HTTPError, e:
-            link.status = str(e.code)
-            logger.info(str(e))
-            link.add_linkproblem(str(e))
-        except urllib2.URLError, e:
-            logger.info(str(e))
-            link.add_linkproblem(str(e))
-        except KeyboardInterrupt:
-            # handle this in a higher-level exception handler
-            raise
-        except Exception, e:
-            # handle all other exceptions
-            logger.exception('unknown exception caught: ' + str(e))
-            link.add_linkproblem('error reading HTTP response: %s' % str(e))
-
-    def _parse_response(self, link, response):
-        """Parse the fetched response content."""
-        # find a parser for the content-type
-        parsermodule = webcheck.parsers.get_parsermodule(link.mimetype)
-        if parsermodule is None:
-            logger.debug('unsupported content-type: %s', link.mimetype)
+        # keep the information from the previous run if not modified
+        if result.status == '304':
+            logger.debug('not modified: %s', link.url)
             return
-        try:
-            # skip parsing of content if we were returned nothing
-            content = response.read()
-            if content is None:
-                return
-            # parse the content
-            logger.debug('parsing using %s', parsermodule.__name__)
-            parsermodule.parse(content, link)
-        except KeyboardInterrupt:
-            # handle this in a higher-level exception handler
-            raise
-        except Exception, e:
-            logger.exception('problem parsing page: %s', str(e))
-            link.add_pageproblem('problem parsing page: %s' % str(e))
+        link.status = result.status
+        link.mimetype = result.mimetype
+        link.set_encoding(result.encoding)
+        link.size = result.size
+        link.transfer_size = result.transfer_size
+        link.mtime = result.mtime
+        link.etag = result.etag
+        for problem in result.linkproblems:
+            link.add_linkproblem(problem)
+        for problem in result.pageproblems:
+            link.add_pageproblem(problem)
+        if result.redirect:
+            link.add_redirect(result.redirect)
+        if parsed is not None:
+            parsed.apply(link)
+        # store the links that were found
+        link.store_found()
+
+    def _store_validated(self, session, results):
+        """Add the problems that were found by validating pages."""
+        for link_id, problems in results:
+            link = session.query(Link).get(link_id)
+            for problem in problems:
+                link.add_pageproblem(problem)
+
+    def _store_duplicates(self, session, memo):
+        """Report the documents that have the same content as another
+        document."""
+        for url, original in memo.duplicates():
+            link = session.query(Link).filter_by(url=url).first()
+            if link is not None:
+                link.add_pageproblem('same content as %s' % original)
 
     def postprocess(self):
         """Do some basic post processing of the collected data, including
@@ -437,6 +631,10 @@ class Crawler(object):
             session.commit()
             depth += 1
             # TODO: also handle embeds
+        # remove any problems that were found by plugins in a previous run
+        session.query(PageProblem).filter(
+            PageProblem.from_plugin == True).delete()
+        last = session.query(func.max(PageProblem.id)).scalar() or 0
         session.commit()
         session.close()
         # see if any of the plugins want to do postprocessing
@@ -444,6 +642,12 @@ class Crawler(object):
             if hasattr(plugin, 'postprocess'):
                 logger.info(plugin.__name__)
                 plugin.postprocess(self)
+        # mark the problems that were added by the plugins
+        session = Session()
+        session.query(PageProblem).filter(PageProblem.id > last).update(
+            dict(from_plugin=True), synchronize_session=False)
+        session.commit()
+        session.close()
 
     def generate(self):
         """Generate pages for plugins."""
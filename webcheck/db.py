@@ -20,24 +20,39 @@
 # The files produced as output from the software do not automatically fall
 # under the copyright of the software, unless explicitly stated otherwise.
 
+import atexit
 import logging
+import os
 import urlparse
 
 from sqlalchemy import Table, Column, Integer, Boolean, String, DateTime, ForeignKey
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref, sessionmaker
 from sqlalchemy.orm.session import object_session
-from sqlalchemy.sql.expression import union
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql.expression import union, or_
 
 from webcheck import config
 from webcheck.myurllib import normalizeurl
+from webcheck.parsers.charset import is_known
 
 
 logger = logging.getLogger(__name__)
 
 
+# the maximum number of values that are passed in a single IN clause
+# (SQLite does not allow more than 999 variables in a statement)
+_CHUNK_SIZE = 500
+
+
+def _chunks(values):
+    """Split the list of values in chunks for use in IN clauses."""
+    for i in range(0, len(values), _CHUNK_SIZE):
+        yield values[i:i + _CHUNK_SIZE]
+
+
 # provide session and schema classes
 Session = sessionmaker()
 Base = declarative_base()
@@ -72,7 +87,9 @@ class Link(Base):
     mimetype = Column(String)
     encoding = Column(String)
     size = Column(Integer)
+    transfer_size = Column(Integer)
     mtime = Column(DateTime, index=True)
+    etag = Column(String)
     is_page = Column(Boolean, index=True)
     title = Column(String, index=True)
     author = Column(String)
@@ -114,21 +131,58 @@ class Link(Base):
             except IntegrityError:
                 pass  # will try again
 
-    def _get_child(self, url):
-        """Get a link object for the specified URL."""
-        # get the session
+    def _get_found(self):
+        """Return the list of (table, url) tuples of links that were found
+        in this link but were not yet stored."""
+        # instances loaded from the database do not run __init__()
+        return vars(self).setdefault('_found', [])
+
+    def store_found(self):
+        """Store the links that were found with add_child() and add_embed()
+        in the database. This creates the new links, updates the depth of
+        existing links and stores any requested anchors."""
+        found = vars(self).pop('_found', None)
+        if not found:
+            return
         session = object_session(self)
-        # normalise the URL, removing the fragment from the URL
-        url, fragment = urlparse.urldefrag(normalizeurl(url))
-        # try to find the link
-        instance = self.get_or_create(session, url)
+        session.flush()
+        depth = (self.depth or 0) + 1
+        # normalise the URLs, removing the fragment
+        found = [(table, ) + urlparse.urldefrag(normalizeurl(url))
+                 for table, url in found]
+        ids = link_index.get_ids(
+            session, [url for table, url, fragment in found], depth)
         # we may have discovered a shorter path
-        instance.depth = min(instance.depth, self.depth + 1) or self.depth + 1
+        for chunk in _chunks(sorted(set(ids.values()))):
+            session.execute(Link.__table__.update().where(
+                Link.id.in_(chunk)).where(
+                    or_(Link.depth == None, Link.depth == 0,
+                        Link.depth > depth)).values(depth=depth))
+        # ensure the new depth is loaded for links in the session
+        updated = set(ids.values())
+        for instance in session.identity_map.values():
+            if isinstance(instance, Link) and instance.id in updated:
+                session.expire(instance, ['depth'])
+        # add the links to children and embedded
+        for table in (children, embedded):
+            rows = [dict(parent_id=self.id, child_id=ids[url])
+                    for t, url, fragment in found if t is table]
+            if rows:
+                session.execute(table.insert(), rows)
         # mark that we were looking for an anchor/fragment
-        if fragment:
-            instance.add_reqanchor(self, fragment)
-        # return the link
-        return instance
+        reqanchors = set()
+        for table, url, fragment in found:
+            if fragment:
+                anchor = self._mk_unicode(fragment).lower()
+                reqanchors.add((ids[url], anchor))
+        if reqanchors:
+            reqanchors.difference_update(session.query(
+                RequestedAnchor.link_id, RequestedAnchor.anchor).filter(
+                    RequestedAnchor.parent_id == self.id))
+        if reqanchors:
+            session.execute(RequestedAnchor.__table__.insert(), [
+                dict(link_id=link_id, parent_id=self.id, anchor=name)
+                for link_id, name in sorted(reqanchors)])
 
     def _mk_unicode(self, message):
         """Turn the message into a unicode object."""
@@ -140,12 +194,11 @@ class Link(Base):
         """Set the encoding of the link doing some basic checks to see if
         the encoding is supported."""
         if not self.encoding and encoding:
-            try:
-                logger.debug('crawler.Link.set_encoding(%r)', encoding)
-                unicode('just some random text', encoding, 'replace')
+            logger.debug('crawler.Link.set_encoding(%r)', encoding)
+            if is_known(encoding):
                 self.encoding = encoding
-            except Exception, e:
-                logger.exception('unknown encoding: %s', encoding)
+            else:
+                logger.warn('unknown encoding: %s', encoding)
                 self.add_pageproblem('unknown encoding: %s' % encoding)
 
     def add_redirect(self, url):
@@ -185,27 +238,38 @@ class Link(Base):
         # ignore children for external links
         if not self.is_internal:
             return
-        # add to children
-        self.children.append(self._get_child(url))
+        # add to children (stored with store_found())
+        self._get_found().append((children, url))
 
     def add_embed(self, url):
         """Mark the given URL as used as an image on this page."""
         # ignore embeds for external links
         if not self.is_internal:
             return
-        # add to embedded
-        self.embedded.append(self._get_child(url))
+        # add to embedded (stored with store_found())
+        self._get_found().append((embedded, url))
 
-    def add_anchor(self, anchor):
-        """Indicate that this page contains the specified anchor."""
-        # lowercase anchor
-        anchor = self._mk_unicode(anchor).lower()
-        if self.anchors.filter(Anchor.anchor == anchor).first():
-            self.add_pageproblem(
-              'anchor/id "%(anchor)s" defined multiple times'
-              % {'anchor': anchor})
-        else:
-            self.anchors.append(Anchor(anchor=anchor))
+    def add_anchors(self, anchors):
+        """Indicate that this page contains the specified anchors."""
+        if not anchors:
+            return
+        session = object_session(self)
+        session.flush()
+        existing = set(anchor for anchor, in session.query(
+            Anchor.anchor).filter(Anchor.link_id == self.id))
+        rows = []
+        for anchor in anchors:
+            # lowercase anchor
+            anchor = self._mk_unicode(anchor).lower()
+            if anchor in existing:
+                self.add_pageproblem(
+                  'anchor/id "%(anchor)s" defined multiple times'
+                  % {'anchor': anchor})
+            else:
+                existing.add(anchor)
+                rows.append(dict(link_id=self.id, anchor=anchor))
+        if rows:
+            session.execute(Anchor.__table__.insert(), rows)
 
     def add_reqanchor(self, parent, anchor):
         """Indicate that the specified link contains a reference to the
@@ -276,6 +340,8 @@ class PageProblem(Base):
     id = Column(Integer, primary_key=True)
     link_id = Column(Integer, ForeignKey('links.id', ondelete='CASCADE'), index=True)
     message = Column(String, index=True)
+    # whether the problem was found by a plugin during postprocessing
+    from_plugin = Column(Boolean, default=False, index=True)
     link = relationship(Link, backref=backref('pageproblems', order_by=message,
                         cascade='all,delete,delete-orphan'))
 
@@ -318,28 +384,162 @@ class RequestedAnchor(Base):
         return self.anchor
 
 
-def setup_db(filename):
-    # open the sqlite file
-    engine = create_engine('sqlite:///' + filename)
+class LinkIndex(object):
+    """Map of URLs to link ids that is used to find the links that are
+    referenced from a page without querying the database for every link.
+    Links that are not in the database are created in bulk."""
+
+    def __init__(self):
+        self._ids = {}
+
+    def load(self, session):
+        """Fill the index with the links in the database."""
+        self._ids = dict(session.query(Link.url, Link.id))
+
+    def clear(self):
+        """Forget all links."""
+        self._ids = {}
+
+    def get_ids(self, session, urls, depth):
+        """Return a dict mapping the URLs to link ids. Links that do not
+        exist yet are created with the specified depth."""
+        missing = []
+        seen = set()
+        for url in urls:
+            if url not in self._ids and url not in seen:
+                seen.add(url)
+                missing.append(url)
+        if missing:
+            session.execute(
+                Link.__table__.insert().prefix_with('OR IGNORE'),
+                [dict(url=url, depth=depth) for url in missing])
+            for chunk in _chunks(missing):
+                self._ids.update(session.query(Link.url, Link.id).filter(
+                    Link.url.in_(chunk)))
+        return dict((url, self._ids[url]) for url in urls)
+
+
+# the index of links that is used during crawling
+link_index = LinkIndex()
+
+
+# the SQLite settings that are used for the storage profiles
+PROFILES = {
+    # the SQLite defaults
+    'default': [],
+    # faster but a power failure may lose the last transactions
+    'fast': ['journal_mode=WAL', 'synchronous=NORMAL', 'cache_size=-65536',
+             'mmap_size=268435456', 'temp_store=MEMORY'],
+    # everything is kept in memory and written to disk at exit
+    'ephemeral': ['cache_size=-65536', 'temp_store=MEMORY'],
+    }
+
+
+def _copy_db(engine, filename, schema):
+    """Copy all tables between the main database of the engine and the
+    database file. The schema (main or disk) is where the rows come from."""
+    target = 'disk' if schema == 'main' else 'main'
+    connection = engine.raw_connection()
+    try:
+        # ATTACH is not allowed within a transaction
+        connection.commit()
+        cursor = connection.cursor()
+        cursor.execute('ATTACH DATABASE ? AS disk', (filename, ))
+        for table in Base.metadata.sorted_tables:
+            columns = ', '.join(column.name for column in table.columns)
+            cursor.execute('DELETE FROM %s.%s' % (target, table.name))
+            cursor.execute('INSERT INTO %s.%s (%s) SELECT %s FROM %s.%s' % (
+                target, table.name, columns, columns, schema, table.name))
+        connection.commit()
+        cursor.execute('DETACH DATABASE disk')
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def _upgrade_db(engine):
+    """Add the columns (and their indexes) that are missing from tables in
+    a database that was created by an earlier version of webcheck. This
+    allows continuing or revalidating a previous run."""
+    connection = engine.connect()
+    try:
+        for table in Base.metadata.sorted_tables:
+            existing = set(row[1] for row in connection.execute(
+                'PRAGMA table_info(%s)' % table.name))
+            if not existing:
+                continue
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                logger.info('adding column %s.%s to the database',
+                            table.name, column.name)
+                connection.execute('ALTER TABLE %s ADD COLUMN %s %s' % (
+                    table.name, column.name,
+                    column.type.compile(engine.dialect)))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(connection)
+    finally:
+        connection.close()
+
+
+def _save_db(engine, filename):
+    """Write the in-memory database to the file."""
+    logger.info('writing database to %s', filename)
+    if os.path.exists(filename):
+        os.remove(filename)
+    # create the tables and indexes in the file
+    Base.metadata.create_all(create_engine('sqlite:///' + filename))
+    _copy_db(engine, filename, 'main')
+
+
+def setup_db(filename, profile='default'):
+    """Configure the database connection. With the ephemeral profile the
+    database is kept in memory and is written to the file at exit (the file
+    is only read when continuing a previous run)."""
+    pragmas = PROFILES[profile]
+    if profile == 'ephemeral':
+        # use a single connection because every connection to :memory:
+        # opens a new database
+        engine = create_engine(
+            'sqlite://', poolclass=StaticPool,
+            connect_args={'check_same_thread': False})
+    else:
+        engine = create_engine('sqlite:///' + filename)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute('PRAGMA ' + pragma)
+        cursor.close()
+
     Session.configure(bind=engine)
     # ensure that all tables are created
     Base.metadata.create_all(engine)
+    if profile == 'ephemeral':
+        if (config.CONTINUE or config.REVALIDATE) and os.path.exists(filename):
+            _upgrade_db(create_engine('sqlite:///' + filename))
+            _copy_db(engine, filename, 'disk')
+        atexit.register(_save_db, engine, filename)
+    else:
+        _upgrade_db(engine)
 
 
 def truncate_db():
-    """Clear all tables in the database."""
-    session = Session()
-    session.query(LinkProblem).delete()
-    session.commit()
-    session.query(PageProblem).delete()
-    session.commit()
-    session.query(Anchor).delete()
-    session.commit()
-    session.query(RequestedAnchor).delete()
-    session.commit()
-    session.execute(children.delete())
-    session.commit()
-    session.execute(embedded.delete())
-    session.commit()
-    session.query(Link).delete()
-    session.commit()
+    """Clear all tables in the database. This replaces the database file
+    (and any SQLite journal files) with an empty database instead of
+    deleting all rows. Other files in the output directory are left
+    alone."""
+    link_index.clear()
+    engine = Session.kw['bind']
+    filename = engine.url.database
+    if filename and filename != ':memory:':
+        # close all connections to the database
+        engine.dispose()
+        for suffix in ('', '-journal', '-wal', '-shm'):
+            if os.path.exists(filename + suffix):
+                os.remove(filename + suffix)
+    else:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
@@ -0,0 +1,685 @@
+
+# fetcher.py - retrieval of URLs for the crawler
+#
+# Copyright (C) 1998, 1999 Albert Hopkins (marduk)
+# Copyright (C) 2002 Mike W. Meyer
+# Copyright (C) 2005, 2006, 2007, 2008, 2011, 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Retrieval of URLs. This module contains the code that talks to the
+network. The fetch() function does not touch the database so it can be
+called from any thread. The results are collected in FetchResult objects
+that are later stored in the database by the crawler."""
+
+import atexit
+import calendar
+import collections
+import cookielib
+import datetime
+import email.utils
+import hashlib
+import logging
+import mimetypes
+import os
+import robotparser
+import threading
+import time
+import urllib2
+import urlparse
+import zlib
+import Queue
+
+from webcheck import config
+from webcheck.cache import ResponseCache
+from webcheck.keepalive import ConnectionPool, KeepAliveHTTPHandler, \
+                               KeepAliveHTTPSHandler
+from webcheck.ratelimit import RateLimiter
+import webcheck.parsers
+
+
+logger = logging.getLogger(__name__)
+
+
+# the number of bytes that are read from the network at a time
+_CHUNK_SIZE = 64 * 1024
+
+
+class RedirectError(urllib2.HTTPError):
+
+    def __init__(self, url, code, msg, hdrs, fp, newurl):
+        self.newurl = newurl
+        urllib2.HTTPError.__init__(self, url, code, msg, hdrs, fp)
+
+
+class NoRedirectHandler(urllib2.HTTPRedirectHandler):
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        raise RedirectError(req.get_full_url(), code, msg, headers, fp, newurl)
+
+
+# the pool of persistent connections
+_connection_pool = None
+
+
+def setup_urllib2():
+    """Configure the urllib2 module to store cookies in the output
+    directory and to use persistent connections."""
+    global _connection_pool
+    import webcheck  # local import to avoid import loop
+    filename = os.path.join(config.OUTPUT_DIR, 'cookies.txt')
+    # set up our cookie jar
+    cookiejar = cookielib.MozillaCookieJar(filename)
+    try:
+        cookiejar.load(ignore_discard=False, ignore_expires=False)
+    except IOError:
+        pass
+    atexit.register(cookiejar.save, ignore_discard=False, ignore_expires=False)
+    # set up our custom opener that sets a meaningful user agent
+    handlers = [urllib2.HTTPCookieProcessor(cookiejar), NoRedirectHandler()]
+    if config.KEEP_ALIVE:
+        _connection_pool = ConnectionPool(config.KEEP_ALIVE_TIMEOUT,
+                                          config.KEEP_ALIVE_POOL_SIZE)
+        handlers.append(KeepAliveHTTPHandler(_connection_pool))
+        if hasattr(urllib2, 'HTTPSHandler'):
+            handlers.append(KeepAliveHTTPSHandler(_connection_pool))
+    opener = urllib2.build_opener(*handlers)
+    opener.addheaders = [
+      ('User-agent', 'webcheck %s' % webcheck.__version__),
+      ]
+    if config.BYPASSHTTPCACHE:
+        opener.addheaders.append(('Cache-control', 'no-cache'))
+        opener.addheaders.append(('Pragma', 'no-cache'))
+    urllib2.install_opener(opener)
+
+
+def close_connections():
+    """Close any idle persistent connections and log some statistics on
+    connection reuse."""
+    if _connection_pool:
+        logger.info('opened %d connections, reused connections %d times',
+                    _connection_pool.opened, _connection_pool.reused)
+        _connection_pool.close()
+
+
+# the cache of retrieved documents
+_cache = None
+
+# the limits on the rate of requests
+_rate_limiter = RateLimiter()
+
+
+def setup_rate_limiter():
+    """Set up the limits on the number of requests per host and the
+    bandwidth that is used."""
+    global _rate_limiter
+    bandwidth = None
+    if config.BANDWIDTH:
+        bandwidth = config.BANDWIDTH * 1024
+    _rate_limiter = RateLimiter(config.WAIT_BETWEEN_REQUESTS, bandwidth)
+
+
+def setup_cache():
+    """Set up the cache of retrieved documents in the output directory if
+    it is enabled."""
+    global _cache
+    if config.CACHE or config.OFFLINE:
+        max_size = None
+        if config.CACHE_SIZE:
+            max_size = config.CACHE_SIZE * 1024 * 1024
+        _cache = ResponseCache(os.path.join(config.OUTPUT_DIR, 'cache'),
+                               max_size, config.CACHE_TTL)
+
+
+def close_cache():
+    """Write the cache of retrieved documents to disk."""
+    global _cache
+    if _cache:
+        _cache.close()
+        _cache = None
+
+
+class FetchResult(object):
+    """The information that was retrieved for a single URL.
+
+    The available properties of this class are:
+
+      url           - the URL that was fetched
+      status        - the status code of the response (as a string)
+      mimetype      - the content type of the response
+      encoding      - the character set as specified in the response headers
+      size          - the size of the (uncompressed) content
+      transfer_size - the number of bytes of content that were transferred
+      mtime         - the last modification time as reported by the server
+      etag          - the entity tag as reported by the server
+      redirect      - the location the URL redirects to
+      linkproblems  - a list of problems retrieving the URL
+      pageproblems  - a list of problems with the retrieved content
+      content       - the retrieved content if it can be parsed
+      digest        - the SHA-1 hash of the content if it was retrieved
+      parsed        - the ParseResult if the content was parsed while it
+                      was retrieved
+      cached        - whether the information was taken from the cache
+      retry_after   - the number of seconds the server asked to wait before
+                      trying again (for 429 and 503 responses)
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.mimetype = None
+        self.encoding = None
+        self.size = None
+        self.transfer_size = None
+        self.mtime = None
+        self.etag = None
+        self.redirect = None
+        self.linkproblems = []
+        self.pageproblems = []
+        self.content = None
+        self.digest = None
+        self.parsed = None
+        self.cached = False
+        self.retry_after = None
+
+
+class HeadRequest(urllib2.Request):
+    """A request that only retrieves the headers."""
+
+    def get_method(self):
+        return 'HEAD'
+
+
+def _open(url, referer=None, head=False, etag=None, mtime=None):
+    """Open the URL, returning the response. If the etag or mtime of a
+    previous retrieval are given a conditional request is made."""
+    # FIXME: if an URI has a username:passwd add the uri, username and password to the HTTPPasswordMgr
+    if head:
+        request = HeadRequest(url)
+    else:
+        request = urllib2.Request(url)
+    if referer:
+        request.add_header('Referer', referer)
+    request.add_header('Accept-encoding', 'gzip, deflate')
+    if etag:
+        request.add_header('If-none-match', etag)
+    if mtime:
+        request.add_header('If-modified-since', email.utils.formatdate(
+            calendar.timegm(mtime.timetuple()), usegmt=True))
+    return urllib2.urlopen(request, timeout=config.IOTIMEOUT)
+
+
+def _may_be_parsed(url):
+    """Guess whether the content of the URL can be parsed based on the
+    extension of the path. If unsure this returns True."""
+    mimetype = mimetypes.guess_type(urlparse.urlsplit(url)[2])[0]
+    return mimetype is None or \
+           webcheck.parsers.get_parsermodule(mimetype) is not None
+
+
+class _Decoder(object):
+    """Streaming decompression of gzip or deflate encoded content."""
+
+    def __init__(self, encoding):
+        if encoding in ('gzip', 'x-gzip'):
+            self._wbits = 16 + zlib.MAX_WBITS
+        else:
+            self._wbits = zlib.MAX_WBITS
+        self._decompressor = zlib.decompressobj(self._wbits)
+        self._first = True
+
+    def decompress(self, data):
+        try:
+            result = self._decompressor.decompress(data)
+        except zlib.error:
+            # some servers send raw deflate data without the zlib header
+            if not self._first or self._wbits != zlib.MAX_WBITS:
+                raise
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            result = self._decompressor.decompress(data)
+        self._first = False
+        return result
+
+    def flush(self):
+        return self._decompressor.flush()
+
+
+def _read(response, result, parser=None):
+    """Read the content of the response in chunks, decompressing it if
+    needed and stopping when the maximum transfer size has been reached.
+    If a parser is passed the chunks are fed to it and the content is only
+    returned if it needs to be stored in the cache or validated."""
+    encoding = (response.info().getheader('Content-Encoding') or '').lower()
+    decoder = None
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        decoder = _Decoder(encoding)
+    maxsize = None
+    if config.MAX_SIZE:
+        maxsize = config.MAX_SIZE * 1024
+    keep = parser is None or _cache is not None or \
+           config.VALIDATE == 'background'
+    digest = hashlib.sha1()
+    chunks = []
+    size = 0
+    transferred = 0
+    while True:
+        data = response.read(_CHUNK_SIZE)
+        _rate_limiter.throttle(len(data))
+        transferred += len(data)
+        eof = not data
+        if decoder:
+            data = decoder.decompress(data) if data else decoder.flush()
+        if maxsize is not None and size + len(data) > maxsize:
+            data = data[:maxsize - size]
+            eof = True
+            result.pageproblems.append(
+                'document larger than %d KB, only the first part was checked'
+                % config.MAX_SIZE)
+        digest.update(data)
+        if parser is not None:
+            parser.feed(data)
+        if keep:
+            chunks.append(data)
+        size += len(data)
+        if eof:
+            break
+    # if the server did not tell us the size we use the number of bytes read
+    if result.size is None:
+        result.size = size
+    if result.transfer_size is None:
+        result.transfer_size = transferred
+    result.digest = digest.hexdigest()
+    if keep:
+        return ''.join(chunks)
+
+
+def _retry_after(value):
+    """Parse the value of a Retry-After header as the number of seconds
+    to wait."""
+    if not value:
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date:
+            return max(0, email.utils.mktime_tz(date) - time.time())
+
+
+def _should_retry(result):
+    """Whether the request should be tried again because the server asked
+    to back off for a short while."""
+    return result.retry_after is not None and \
+           result.retry_after <= config.MAX_RETRY_AFTER
+
+
+def fetch(url, referer=None, external=False, etag=None, mtime=None):
+    """Attempt to fetch the url and return a FetchResult with the
+    retrieved information. The content is only read if it can be parsed.
+
+    If HEAD requests are enabled, external URLs and URLs that do not look
+    like they can be parsed are first tried with a HEAD request. A GET
+    request is only done if the server does not support HEAD or if the
+    content of an internal URL turns out to be parseable.
+
+    If the etag or mtime are passed the server is asked to only return
+    the content if it was modified (a 304 status is returned otherwise).
+
+    If the cache is enabled the information is taken from the cache if
+    possible. When working offline only the cache is used.
+
+    Before making the request this waits until requests to the host are
+    allowed by the rate limiter."""
+    logger.info(url)
+    result = FetchResult(url)
+    head = config.HEAD_REQUESTS and (external or not _may_be_parsed(url))
+    # the content of external URLs is not needed if HEAD is used
+    parse = not (head and external)
+    if _cache and _cache.get(url, result, parse, expired=config.OFFLINE):
+        logger.debug('using cached information for %s', url)
+        result.cached = True
+        return result
+    if config.OFFLINE:
+        result.linkproblems.append('not available in cache')
+        return result
+    location = urlparse.urlsplit(url)[0:2]
+    _rate_limiter.wait(location)
+    try:
+        response = None
+        if head:
+            try:
+                response = _open(url, referer, True, etag, mtime)
+            except RedirectError:
+                raise
+            except urllib2.HTTPError, e:
+                # only fall back to GET if HEAD is not supported
+                if e.code not in (405, 501):
+                    raise
+                e.close()
+                logger.debug('HEAD not supported: %s', str(e))
+                head = False
+            else:
+                # get the content if we can parse it
+                if parse and webcheck.parsers.get_parsermodule(
+                                        response.info().gettype()):
+                    response.close()
+                    response = None
+                    head = False
+        if response is None:
+            response = _open(url, referer, False, etag, mtime)
+        info = response.info()
+        result.mimetype = info.gettype()
+        result.encoding = response.headers.getparam('charset')
+        # get result code and other stuff
+        result.status = str(response.code)
+        try:
+            result.transfer_size = int(info.getheader('Content-length'))
+        except (TypeError, ValueError):
+            pass
+        # the size of the document is only known if it is not compressed
+        if (info.getheader('Content-Encoding') or 'identity').lower() == 'identity':
+            result.size = result.transfer_size
+        result.etag = info.getheader('ETag')
+        modified = info.getdate('Last-Modified')
+        if modified:
+            result.mtime = datetime.datetime(*modified[:7])
+        # if response.status == 301: link.add_linkproblem(str(response.status)+': '+response.reason)
+        # elif response.status != 200: link.add_linkproblem(str(response.status)+': '+response.reason)
+        # only read the content if we are going to parse it
+        if parse and not head and \
+           webcheck.parsers.get_parsermodule(result.mimetype):
+            parser = None
+            if config.STREAM_PARSING:
+                parser = webcheck.parsers.get_streamparser(
+                    result.mimetype, url, not external, result.encoding)
+            result.content = _read(response, result, parser)
+            if parser is not None:
+                result.parsed = parser.close()
+        response.close()
+    except RedirectError, e:
+        e.close()
+        result.status = str(e.code)
+        logger.info(str(e))
+        if e.code == 301:
+            result.linkproblems.append(str(e))
+        result.redirect = e.newurl
+    except urllib2.HTTPError, e:
+        e.close()
+        result.status = str(e.code)
+        logger.info(str(e))
+        # not modified is not a problem
+        if e.code != 304:
+            result.linkproblems.append(str(e))
+        # the server may ask us to come back later
+        if e.code in (429, 503):
+            result.retry_after = _retry_after(e.info().getheader('Retry-After'))
+            if result.retry_after is not None:
+                _rate_limiter.backoff(location, result.retry_after)
+    except urllib2.URLError, e:
+        logger.info(str(e))
+        result.linkproblems.append(str(e))
+    except KeyboardInterrupt:
+        # handle this in a higher-level exception handler
+        raise
+    except Exception, e:
+        # handle all other exceptions
+        logger.exception('unknown exception caught: ' + str(e))
+        result.linkproblems.append('error reading HTTP response: %s' % str(e))
+    # only store responses from the server in the cache
+    if _cache and result.status and result.status != '304' and \
+       result.retry_after is None:
+        _cache.put(result, parse)
+    return result
+
+
+def _crawl_delay(lines, useragent='webcheck'):
+    """Return the Crawl-delay from the lines of a robots.txt file that
+    applies to the user agent or None if there is none."""
+    delays = {}
+    agents = []
+    rules = False
+    for line in lines:
+        line = line.split('#', 1)[0]
+        if ':' not in line:
+            continue
+        key, value = [x.strip() for x in line.split(':', 1)]
+        key = key.lower()
+        if key == 'user-agent':
+            # a User-agent line after some rules starts a new record
+            if rules:
+                agents = []
+                rules = False
+            agents.append(value.lower())
+        else:
+            rules = True
+            if key == 'crawl-delay':
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for agent in agents:
+                    delays.setdefault(agent, delay)
+    for agent, delay in delays.items():
+        if agent != '*' and agent in useragent:
+            return delay
+    return delays.get('*')
+
+
+def read_robots(rp):
+    """Read the robots.txt file for the RobotFileParser. This does the same
+    as rp.read() but takes the file from the cache if it is enabled and
+    configures the rate limiter with the Crawl-delay from the file."""
+    result = FetchResult(rp.url)
+    if not (_cache and _cache.get(rp.url, result, expired=config.OFFLINE)):
+        if config.OFFLINE:
+            # handle it as a missing robots.txt file
+            rp.allow_all = True
+            return
+        opener = robotparser.URLopener()
+        f = opener.open(rp.url)
+        result.content = '\n'.join(line.strip() for line in f)
+        f.close()
+        result.status = str(opener.errcode)
+        if _cache:
+            _cache.put(result)
+    lines = result.content.splitlines() if result.content else []
+    rp.errcode = int(result.status)
+    if rp.errcode in (401, 403):
+        rp.disallow_all = True
+    elif rp.errcode >= 400 and rp.errcode < 500:
+        rp.allow_all = True
+    elif rp.errcode == 200 and lines:
+        rp.parse(lines)
+        delay = _crawl_delay(lines)
+        if delay:
+            _rate_limiter.set_delay(urlparse.urlsplit(rp.url)[0:2], delay)
+
+
+def _fetch(url, **kwargs):
+    """Call fetch() and return a FetchResult with a link problem if an
+    unexpected exception is raised so the link is always stored."""
+    try:
+        return fetch(url, **kwargs)
+    except Exception, e:
+        logger.exception('unknown exception caught: %s', str(e))
+        result = FetchResult(url)
+        result.linkproblems.append('error retrieving URL: %s' % str(e))
+        return result
+
+
+class InlineFetcher(object):
+    """Fetcher that retrieves URLs one at a time in the calling thread.
+    This has the same interface as FetcherPool."""
+
+    def __init__(self):
+        self._results = collections.deque()
+
+    def has_room(self, external=False):
+        """Whether another job can be submitted."""
+        return not self._results
+
+    def active(self):
+        """The number of jobs that have not been collected with get()."""
+        return len(self._results)
+
+    def submit(self, key, url, **kwargs):
+        """Fetch the URL. The key is returned with the result. Any keyword
+        arguments are passed to fetch()."""
+        result = _fetch(url, **kwargs)
+        if _should_retry(result):
+            result = _fetch(url, **kwargs)
+        self._results.append((key, result))
+
+    def get(self):
+        """Return a (key, FetchResult) tuple for a submitted job."""
+        return self._results.popleft()
+
+    def close(self):
+        pass
+
+
+class FetcherPool(object):
+    """Pool of worker threads that retrieve URLs concurrently. No more than
+    per_host connections are made to a single scheme+netloc at any time.
+
+    If external_threads is set, external URLs are retrieved by a separate
+    set of worker threads. This way a large number of slow external link
+    checks can be in progress without holding up the crawling of the
+    internal site."""
+
+    def __init__(self, threads, per_host, external_threads=0):
+        self.per_host = max(per_host, 1)
+        self._lock = threading.Condition()
+        # the lanes (False for internal and True for external jobs)
+        lanes = [False]
+        if external_threads > 0:
+            lanes.append(True)
+        self._threads = {False: max(threads, 1), True: external_threads}
+        # per lane a map of scheme+netloc to deques of waiting jobs
+        self._pending = dict((lane, collections.OrderedDict())
+                             for lane in lanes)
+        # map of scheme+netloc to the number of running jobs
+        self._running = collections.defaultdict(int)
+        # per lane the number of jobs that have not been collected
+        self._active = dict((lane, 0) for lane in lanes)
+        self._closed = False
+        self._results = Queue.Queue()
+        for lane in lanes:
+            for i in range(self._threads[lane]):
+                worker = threading.Thread(
+                    target=self._work, args=(lane, ),
+                    name='fetcher-%s-%d' % ('external' if lane else 'internal', i))
+                worker.daemon = True
+                worker.start()
+
+    def _lane(self, external):
+        """Return the lane that is used for internal or external jobs."""
+        return bool(external) and True in self._active
+
+    def has_room(self, external=False):
+        """Whether another internal or external job can be submitted
+        without needlessly queueing up jobs in its lane."""
+        lane = self._lane(external)
+        with self._lock:
+            return self._active[lane] < self._threads[lane] * 2
+
+    def active(self):
+        """The number of jobs that have not been collected with get()."""
+        with self._lock:
+            return sum(self._active.values())
+
+    def submit(self, key, url, **kwargs):
+        """Queue the URL for fetching. The key is returned with the
+        result. Any keyword arguments are passed to fetch()."""
+        lane = self._lane(kwargs.get('external', False))
+        location = urlparse.urlsplit(url)[0:2]
+        with self._lock:
+            self._pending[lane].setdefault(
+                location, collections.deque()).append((key, url, kwargs, True))
+            self._active[lane] += 1
+            self._lock.notify_all()
+
+    def get(self):
+        """Return a (key, FetchResult) tuple for a submitted job, waiting for
+        one to become available."""
+        # wait with a timeout to keep KeyboardInterrupt working
+        while True:
+            try:
+                lane, key, result = self._results.get(True, 1)
+                break
+            except Queue.Empty:
+                pass
+        with self._lock:
+            self._active[lane] -= 1
+        return key, result
+
+    def close(self):
+        """Stop the worker threads."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+
+    def _take(self, lane):
+        """Return the next job of the lane of which the host has room for
+        another connection and is not held back by the rate limiter. If
+        there is no such job None is returned together with the number of
+        seconds until a held back job becomes available (called with the
+        lock held)."""
+        pending = self._pending[lane]
+        timeout = None
+        for location, jobs in pending.iteritems():
+            # only use a single connection to hosts that need a delay
+            limit = self.per_host
+            if _rate_limiter.get_delay(location):
+                limit = 1
+            if self._running[location] >= limit:
+                continue
+            wait = _rate_limiter.ready_in(location)
+            if wait > 0:
+                timeout = wait if timeout is None else min(timeout, wait)
+                continue
+            job = jobs.popleft()
+            if not jobs:
+                del pending[location]
+            self._running[location] += 1
+            return (location, job), None
+        return None, timeout
+
+    def _work(self, lane):
+        """Main loop of the worker threads."""
+        while True:
+            with self._lock:
+                job, timeout = self._take(lane)
+                while job is None:
+                    if self._closed:
+                        return
+                    self._lock.wait(timeout)
+                    job, timeout = self._take(lane)
+            location, (key, url, kwargs, retry) = job
+            result = _fetch(url, **kwargs)
+            with self._lock:
+                self._running[location] -= 1
+                # try again later if the server asked us to
+                if retry and _should_retry(result):
+                    self._pending[lane].setdefault(
+                        location, collections.deque()).appendleft(
+                            (key, url, kwargs, False))
+                    result = None
+                self._lock.notify_all()
+            if result is not None:
+                self._results.put((lane, key, result))
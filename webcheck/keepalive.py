@@ -0,0 +1,212 @@
+
+# keepalive.py - persistent HTTP connections for urllib2
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Handlers for urllib2 that keep HTTP/1.1 connections open after a
+response has been read so the connection can be used again for the next
+request to the same host. The standard urllib2 handlers always close the
+connection after a single request."""
+
+import httplib
+import logging
+import socket
+import threading
+import time
+import urllib2
+
+
+logger = logging.getLogger(__name__)
+
+
+# the maximum number of bytes that are read from an unfinished response
+# to be able to reuse the connection (otherwise it is closed)
+_MAX_DRAIN = 64 * 1024
+
+
+class ConnectionPool(object):
+    """Storage of idle connections per scheme and host. Connections that
+    have been idle for longer than idle_time seconds are discarded and no
+    more than max_idle idle connections are kept per host."""
+
+    def __init__(self, idle_time=15, max_idle=4):
+        self.idle_time = idle_time
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        # map of (scheme, host) to list of (connection, time) tuples
+        self._idle = {}
+        # connection statistics
+        self.opened = 0
+        self.reused = 0
+
+    def get(self, key):
+        """Return an idle connection for the host or None."""
+        with self._lock:
+            connections = self._idle.get(key, [])
+            while connections:
+                conn, since = connections.pop()
+                if since + self.idle_time > time.time():
+                    self.reused += 1
+                    return conn
+                conn.close()
+
+    def register(self):
+        """Register that a new connection was made."""
+        with self._lock:
+            self.opened += 1
+
+    def put(self, key, conn):
+        """Return the connection to the pool for later reuse."""
+        with self._lock:
+            connections = self._idle.setdefault(key, [])
+            if len(connections) < self.max_idle:
+                connections.append((conn, time.time()))
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            for connections in self._idle.values():
+                for conn, since in connections:
+                    conn.close()
+            self._idle = {}
+
+
+class _PooledResponse(object):
+    """Wrapper around a httplib.HTTPResponse that returns the connection to
+    the pool when the response has been completely read."""
+
+    def __init__(self, pool, key, conn, response):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+
+    def _release(self):
+        """Hand the connection back to the pool if it can be reused."""
+        conn = self._conn
+        self._conn = None
+        if conn is None:
+            return
+        if self._response.will_close or conn.sock is None:
+            conn.close()
+        else:
+            self._pool.put(self._key, conn)
+
+    def read(self, amt=None):
+        data = self._response.read(amt)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    # socket._fileobject calls recv()
+    recv = read
+
+    def fileno(self):
+        return self._response.fileno()
+
+    def close(self):
+        """Close the response. If only a small part of the response is left
+        it is read to be able to reuse the connection."""
+        if self._conn is None:
+            return
+        try:
+            if not self._response.isclosed() and \
+               self._response.length is not None and \
+               self._response.length <= _MAX_DRAIN:
+                self._response.read()
+        except (socket.error, httplib.HTTPException):
+            pass
+        if self._response.isclosed():
+            self._release()
+        else:
+            self._response.close()
+            self._conn.close()
+            self._conn = None
+
+
+class _KeepAliveMixin(object):
+    """Implementation of do_open() that takes connections from the pool."""
+
+    def _request(self, conn, req, headers):
+        """Send the request and return the response."""
+        conn.request(req.get_method(), req.get_selector(), req.data, headers)
+        try:
+            return conn.getresponse(buffering=True)
+        except TypeError:  # buffering kw not supported
+            return conn.getresponse()
+
+    def do_open(self, http_class, req, **http_conn_args):
+        # fall back to the normal handler for proxy tunnels
+        if req._tunnel_host:
+            return urllib2.AbstractHTTPHandler.do_open(
+                self, http_class, req, **http_conn_args)
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+        key = (req.get_type(), host)
+        headers = dict(req.unredirected_hdrs)
+        headers.update(dict((k, v) for k, v in req.headers.items()
+                            if k not in headers))
+        headers = dict(
+            (name.title(), val) for name, val in headers.items())
+        # first try an existing connection
+        conn = self.pool.get(key)
+        response = None
+        if conn is not None:
+            try:
+                conn.sock.settimeout(req.timeout)
+                response = self._request(conn, req, headers)
+            except (socket.error, httplib.HTTPException), e:
+                # the server probably closed the idle connection
+                logger.debug('reused connection failed: %s', str(e))
+                conn.close()
+        # make a new connection
+        if response is None:
+            conn = http_class(host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(self._debuglevel)
+            self.pool.register()
+            try:
+                response = self._request(conn, req, headers)
+            except socket.error, err:
+                conn.close()
+                raise urllib2.URLError(err)
+        # pick apart the HTTPResponse object just like urllib2 does
+        fp = socket._fileobject(
+            _PooledResponse(self.pool, key, conn, response), close=True)
+        resp = urllib2.addinfourl(fp, response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class KeepAliveHTTPHandler(_KeepAliveMixin, urllib2.HTTPHandler):
+
+    def __init__(self, pool, debuglevel=0):
+        urllib2.HTTPHandler.__init__(self, debuglevel)
+        self.pool = pool
+
+
+class KeepAliveHTTPSHandler(_KeepAliveMixin, urllib2.HTTPSHandler):
+
+    def __init__(self, pool, debuglevel=0, context=None):
+        urllib2.HTTPSHandler.__init__(self, debuglevel, context)
+        self.pool = pool
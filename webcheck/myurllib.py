@@ -20,7 +20,9 @@
 # The files produced as output from the software do not automatically fall
 # under the copyright of the software, unless explicitly stated otherwise.
 
+import collections
 import re
+import threading
 import urllib
 import urlparse
 
@@ -49,6 +51,16 @@ _doubleslashpattern = re.compile('//+')
 # pattern for leading dots
 _leadingdotpattern = re.compile('^(/\.\.)*')
 
+# pattern for URLs that are not changed by normalisation: http(s) URLs with
+# a lowercase host without port and relative URLs, with only characters that
+# need no escaping (no fragment and no trailing ?)
+_canonicalpattern = re.compile(
+    '^(?:https?://[a-z0-9.-]+/(?!\.\.)[-;/?:@&=+$,.0-9A-Za-z_~]*|'
+    '(?!//)[-;/?@&=+$,.0-9A-Za-z_~]*)(?<!\?)\Z')
+
+# the maximum number of normalised URLs that are remembered
+_CACHE_SIZE = 10000
+
 
 def _unescape_printable(match):
     """Helper function for _normalize_escapes() to perform the expansion of
@@ -110,6 +122,27 @@ def _urlclean(url):
     return urlparse.urlunsplit((scheme, netloc, path, query, fragment))
 
 
+# the least recently used normalised URLs
+_cache = collections.OrderedDict()
+_cache_lock = threading.Lock()
+
+
 def normalizeurl(url):
     """Return a normalized URL."""
-    return _urlclean(url)
+    # most URLs need no changes at all
+    if _canonicalpattern.match(url):
+        return url
+    # the same URLs are seen over and over (e.g. in navigation menus)
+    with _cache_lock:
+        try:
+            result = _cache.pop(url)
+            _cache[url] = result
+            return result
+        except KeyError:
+            pass
+    result = _urlclean(url)
+    with _cache_lock:
+        _cache[url] = result
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
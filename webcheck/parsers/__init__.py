@@ -26,7 +26,42 @@ A content-type module can be requested by the get_parsemodule() function.
 Each module should export the following function:
 
     parse(content, link)
-        Based on the content, fill in the common fields of the link object."""
+        Based on the content, fill in the common fields of the link object
+        (a ParseResult).
+
+Modules may also export the following function for incremental parsing:
+
+    stream(link)
+        Return an object with feed(data) and close() methods that fills in
+        the link object while the content is passed in chunks or None if
+        incremental parsing is not supported.
+
+The content is passed to the modules as unicode. It is decoded once using
+the encoding that is determined by the charset module. That encoding is
+stored in the link object, also when it differs from the one in the HTTP
+headers.
+
+Parsing does not touch the database so it can be done in separate
+processes. The ParseResult is stored in the Link afterwards.
+
+The ParseResult also keeps track of the limits for parsing a single
+document. Modules should call count_element() for every element and
+check the result of use_css() before handling inline CSS. When the time
+or element limit is reached ParseLimitError is raised after which the
+module should stop parsing and keep the information found so far."""
+
+import collections
+import logging
+import time
+import urlparse
+
+from webcheck import config
+from webcheck.parsers.charset import is_known, decode, StreamDecoder
+from webcheck.workers import WorkerPool
+
+
+logger = logging.getLogger(__name__)
+
 
 # the modules that should be imported
 _modules = ('html', 'css')
@@ -53,3 +88,457 @@ def get_parsermodule(mimetype):
     if mimetype in _parsermodules:
         return _parsermodules[mimetype]
     return None
+
+
+class ParseLimitError(Exception):
+    """Raised when parsing a document takes too long or the document has
+    too many elements."""
+
+
+class _Budget(object):
+    """What has been used of the limits for parsing a single document."""
+
+    def __init__(self):
+        # the parse time of earlier chunks and the start of the current one
+        self.used = 0.0
+        self.started = None
+        self.elements = 0
+        self.links = 0
+        self.css = 0
+        # the limits that were reached
+        self.exceeded = set()
+
+
+class ParseResult(object):
+    """The information that was found while parsing a document. This has
+    the same methods as the Link object that the parser modules use but can
+    be passed between processes.
+
+    The available properties of this class are:
+
+      url         - the URL of the document
+      is_internal - whether the document is part of the checked site
+      encoding    - the character encoding of the document
+      title       - the title of the document
+      author      - the author of the document
+      is_page     - whether the document is a page
+      base        - the base URL that is set in the document (if any)
+      children    - the list of URLs that are linked from the document
+      embedded    - the list of URLs that are embedded in the document
+      anchors     - the list of anchors defined in the document
+      problems    - the list of problems that were found
+
+    The children and embedded URLs are kept as they are found in the
+    document and are resolved against the base (or the URL of the
+    document) when they are stored in the Link. This way the same result
+    can be used for documents with the same content under different
+    URLs.
+    """
+
+    # the information that is passed between processes
+    _fields = ('url', 'is_internal', 'encoding', 'title', 'author',
+               'is_page', 'base', 'children', 'embedded', 'anchors',
+               'problems')
+
+    __slots__ = _fields + ('_anchorset', '_budget')
+
+    def __init__(self, url, is_internal=True, encoding=None):
+        self.url = url
+        self.is_internal = is_internal
+        self.encoding = None
+        if encoding and is_known(encoding):
+            self.encoding = encoding
+        self.title = None
+        self.author = None
+        self.is_page = False
+        self.base = None
+        self.children = []
+        self.embedded = []
+        self.anchors = []
+        self.problems = []
+        self._anchorset = set()
+        self._budget = _Budget()
+
+    def __getstate__(self):
+        return tuple(getattr(self, x) for x in self._fields)
+
+    def __setstate__(self, state):
+        for name, value in zip(self._fields, state):
+            setattr(self, name, value)
+
+    def _mk_unicode(self, message):
+        """Turn the message into a unicode object."""
+        if not isinstance(message, unicode):
+            message = unicode(message, encoding=self.encoding or 'utf-8', errors='replace')
+        return message
+
+    def set_encoding(self, encoding):
+        """Set the encoding of the document doing some basic checks to see
+        if the encoding is supported."""
+        if not self.encoding and encoding:
+            if is_known(encoding):
+                self.encoding = encoding
+            else:
+                logger.warn('unknown encoding: %s', encoding)
+                self.add_pageproblem('unknown encoding: %s' % encoding)
+
+    def add_pageproblem(self, message):
+        """Indicate that something went wrong with parsing the document."""
+        # only think about problems on internal pages
+        if self.is_internal:
+            self.problems.append(message)
+
+    def _exceeded(self, limit, message):
+        """Report that the limit was reached (only once per limit)."""
+        if limit not in self._budget.exceeded:
+            self._budget.exceeded.add(limit)
+            logger.info('%s: %s', self.url, message)
+            self.add_pageproblem(message)
+
+    def _start_timer(self):
+        """Start measuring the time spent on parsing."""
+        self._budget.started = time.time()
+
+    def _stop_timer(self):
+        """Stop measuring the time spent on parsing."""
+        self._budget.used += time.time() - self._budget.started
+        self._budget.started = None
+
+    @property
+    def stopped(self):
+        """Whether parsing was stopped because of the time or element
+        limit."""
+        return bool(self._budget.exceeded & set(('time', 'elements')))
+
+    def check_time(self):
+        """Raise ParseLimitError if parsing took too long."""
+        budget = self._budget
+        if config.MAX_PARSE_TIME and budget.started is not None and \
+           budget.used + time.time() - budget.started > config.MAX_PARSE_TIME:
+            self._exceeded('time', 'parsing stopped after %d seconds'
+                                   % config.MAX_PARSE_TIME)
+            raise ParseLimitError('parse time limit reached')
+
+    def count_element(self):
+        """Register an element of the document. This raises
+        ParseLimitError if the document has too many elements or parsing
+        took too long."""
+        budget = self._budget
+        budget.elements += 1
+        if config.MAX_ELEMENTS and budget.elements > config.MAX_ELEMENTS:
+            self._exceeded('elements', 'parsing stopped after %d elements'
+                                       % config.MAX_ELEMENTS)
+            raise ParseLimitError('element limit reached')
+        # looking at the clock for every element is wasteful
+        if budget.elements % 100 == 0:
+            self.check_time()
+
+    def use_css(self, size):
+        """Register size characters of inline CSS and return whether the
+        CSS should be handled."""
+        budget = self._budget
+        budget.css += size
+        if config.MAX_INLINE_CSS and \
+           budget.css > config.MAX_INLINE_CSS * 1024:
+            self._exceeded('css', 'more than %d kilobytes of inline CSS, '
+                                  'the rest is ignored' % config.MAX_INLINE_CSS)
+            return False
+        return True
+
+    def _use_link(self):
+        """Register a link and return whether it should be added."""
+        budget = self._budget
+        budget.links += 1
+        if config.MAX_LINKS and budget.links > config.MAX_LINKS:
+            self._exceeded('links', 'more than %d links, the rest is ignored'
+                                    % config.MAX_LINKS)
+            return False
+        return True
+
+    def add_child(self, url):
+        """Add the specified URL as a child of this document."""
+        # ignore children for external links
+        if self.is_internal and self._use_link():
+            self.children.append(url)
+
+    def add_embed(self, url):
+        """Mark the given URL as used as an image on this page."""
+        # ignore embeds for external links
+        if self.is_internal and self._use_link():
+            self.embedded.append(url)
+
+    def add_anchor(self, anchor):
+        """Indicate that this page contains the specified anchor."""
+        # lowercase anchor
+        anchor = self._mk_unicode(anchor).lower()
+        if anchor in self._anchorset:
+            self.add_pageproblem(
+              'anchor/id "%(anchor)s" defined multiple times'
+              % {'anchor': anchor})
+        else:
+            self._anchorset.add(anchor)
+            self.anchors.append(anchor)
+
+    def apply(self, link):
+        """Store the information in the Link object. The found links are
+        stored with link.store_found()."""
+        # the encoding that was used to decode the content
+        if self.encoding:
+            link.encoding = self.encoding
+        if self.title is not None:
+            link.title = self.title
+        if self.author is not None:
+            link.author = self.author
+        if self.is_page:
+            link.is_page = True
+        for problem in self.problems:
+            link.add_pageproblem(problem)
+        link.add_anchors(self.anchors)
+        base = self.url if self.base is None else self.base
+        for url in self.children:
+            link.add_child(urlparse.urljoin(base, url))
+        for url in self.embedded:
+            link.add_embed(urlparse.urljoin(base, url))
+
+
+def parse(content, mimetype, url, is_internal=True, encoding=None):
+    """Parse the content using the module for the mimetype. This returns a
+    ParseResult or None if the content-type is not supported."""
+    # find a parser for the content-type
+    parsermodule = get_parsermodule(mimetype)
+    if parsermodule is None:
+        logger.debug('unsupported content-type: %s', mimetype)
+        return None
+    result = ParseResult(url, is_internal, encoding)
+    result._start_timer()
+    try:
+        # decode the content once for all parsers
+        content, encoding = decode(content, result.encoding)
+        if encoding:
+            result.encoding = encoding
+        # parse the content
+        logger.debug('parsing using %s', parsermodule.__name__)
+        parsermodule.parse(content, result)
+    except KeyboardInterrupt:
+        # handle this in a higher-level exception handler
+        raise
+    except ParseLimitError:
+        # the problem has been reported already
+        pass
+    except Exception, e:
+        logger.exception('problem parsing page: %s', str(e))
+        result.add_pageproblem('problem parsing page: %s' % str(e))
+    result._stop_timer()
+    return result
+
+
+class StreamParser(object):
+    """Parser that processes the content in chunks while it is being
+    retrieved. The ParseResult is returned by close()."""
+
+    def __init__(self, parser, result):
+        self._parser = parser
+        self.result = result
+        self._decoder = StreamDecoder(result.encoding)
+
+    def _failed(self, e):
+        logger.exception('problem parsing page: %s', str(e))
+        self.result.add_pageproblem('problem parsing page: %s' % str(e))
+        self._parser = None
+
+    def feed(self, data):
+        """Parse the next chunk of content."""
+        # the rest of the content is ignored when a limit was reached
+        if self._parser is None or self.result.stopped:
+            return
+        self.result._start_timer()
+        try:
+            data = self._decoder.decode(data)
+            if data:
+                self._parser.feed(data)
+                # also stop parsers that do not see any elements
+                self.result.check_time()
+        except KeyboardInterrupt:
+            # handle this in a higher-level exception handler
+            raise
+        except ParseLimitError:
+            # the parser is closed later to keep what was found so far
+            pass
+        except Exception, e:
+            self._failed(e)
+        self.result._stop_timer()
+
+    def close(self):
+        """Finish parsing and return the ParseResult."""
+        if self._parser is not None:
+            self.result._start_timer()
+            try:
+                if not self.result.stopped:
+                    data = self._decoder.decode('', True)
+                    if data:
+                        self._parser.feed(data)
+                if self._decoder.encoding:
+                    self.result.encoding = self._decoder.encoding
+                self._parser.close()
+            except KeyboardInterrupt:
+                # handle this in a higher-level exception handler
+                raise
+            except ParseLimitError:
+                # the problem has been reported already
+                pass
+            except Exception, e:
+                self._failed(e)
+            self.result._stop_timer()
+        return self.result
+
+
+def get_streamparser(mimetype, url, is_internal=True, encoding=None):
+    """Return a StreamParser for content of the mimetype or None if the
+    content cannot be parsed incrementally."""
+    parsermodule = get_parsermodule(mimetype)
+    if parsermodule is None or not hasattr(parsermodule, 'stream'):
+        return None
+    result = ParseResult(url, is_internal, encoding)
+    parser = parsermodule.stream(result)
+    if parser is not None:
+        return StreamParser(parser, result)
+
+
+# the maximum number of ParseResults that are remembered
+_MEMO_SIZE = 1000
+
+
+def _copy(result, url):
+    """Return a copy of the ParseResult for the document at url."""
+    copy = ParseResult(url)
+    copy.__setstate__(result.__getstate__())
+    copy.url = url
+    copy.problems = list(result.problems)
+    return copy
+
+
+class ParseMemo(object):
+    """Remember ParseResults by the hash of the content so documents that
+    are retrieved under different URLs (e.g. print versions or URLs with
+    session parameters) are only parsed once. The URLs of all documents
+    are kept to find documents with the same content with duplicates().
+
+    The key should identify the content and anything else that influences
+    parsing (the content type, the encoding from the HTTP headers and
+    whether the document is internal)."""
+
+    def __init__(self, size=_MEMO_SIZE):
+        self.size = size
+        # map of key to the URLs of the documents with the content
+        self._urls = {}
+        # map of key to ParseResult
+        self._results = {}
+
+    def _add_url(self, key, url):
+        """Remember that the document at url has the content."""
+        urls = self._urls.setdefault(key, [])
+        if url not in urls:
+            urls.append(url)
+
+    def get(self, key, url):
+        """Return the ParseResult for the document at url if a document
+        with the same key was parsed before or None otherwise."""
+        if key is None or key not in self._results:
+            return None
+        self._add_url(key, url)
+        return _copy(self._results[key], url)
+
+    def put(self, key, result):
+        """Remember the ParseResult of the document."""
+        if key is None or result is None:
+            return
+        if len(self._results) >= self.size:
+            self._results.clear()
+        self._results[key] = _copy(result, result.url)
+        self._add_url(key, result.url)
+
+    def duplicates(self):
+        """Return (url, original) tuples for documents that have the same
+        content as another document. Of the documents with the same content
+        the one with the shortest URL is considered the original so the
+        outcome does not depend on the order of retrieval."""
+        for urls in self._urls.itervalues():
+            if len(urls) > 1:
+                original = min(urls, key=lambda url: (len(url), url))
+                for url in urls:
+                    if url != original:
+                        yield url, original
+
+
+class InlineParser(object):
+    """Parser that parses documents one at a time in the calling thread.
+    This has the same interface as ParserPool."""
+
+    def __init__(self):
+        self._results = collections.deque()
+
+    def has_room(self):
+        """Whether another job can be submitted."""
+        return not self._results
+
+    def active(self):
+        """The number of jobs that have not been collected with get()."""
+        return len(self._results)
+
+    def ready(self):
+        """Whether get() will return without waiting."""
+        return bool(self._results)
+
+    def submit(self, key, content, *args):
+        """Parse the content. The key is returned with the result. Any
+        other arguments are passed to parse()."""
+        self._results.append((key, parse(content, *args)))
+
+    def get(self):
+        """Return a (key, ParseResult) tuple for a submitted job."""
+        return self._results.popleft()
+
+    def close(self):
+        pass
+
+
+class ParserPool(object):
+    """Pool of worker processes that parse documents concurrently so
+    parsing is not limited to a single processor."""
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._pool = WorkerPool(processes)
+
+    def has_room(self):
+        """Whether another job can be submitted without needlessly queueing
+        up documents."""
+        return self._pool.active() < self.processes * 2
+
+    def active(self):
+        """The number of jobs that have not been collected with get()."""
+        return self._pool.active()
+
+    def ready(self):
+        """Whether get() will return without waiting."""
+        return self._pool.ready()
+
+    def submit(self, key, content, *args):
+        """Queue the content for parsing. The key is returned with the
+        result. Any other arguments are passed to parse()."""
+        self._pool.submit((key, args), parse, content, *args)
+
+    def get(self):
+        """Return a (key, ParseResult) tuple for a submitted job, waiting
+        for one to become available. If the job failed (e.g. because the
+        worker process crashed) the ParseResult has a page problem."""
+        (key, args), result, problem = self._pool.get()
+        if problem is not None:
+            mimetype, url = args[:2]
+            result = ParseResult(url, *args[2:])
+            result.add_pageproblem('problem parsing page: %s' % problem)
+        return key, result
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.close()
@@ -0,0 +1,169 @@
+
+# charset.py - determine the character encoding of documents
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Determine the character encoding of documents. The encoding is settled
+before parsing from a byte order mark, the HTTP headers or a declaration
+at the start of the document so the content only has to be decoded once.
+The parser modules are passed the decoded content."""
+
+import codecs
+import re
+
+
+# the number of bytes that are searched for an encoding declaration
+SNIFF_SIZE = 4096
+
+# the byte order marks that identify an encoding
+_boms = (('\xef\xbb\xbf', 'utf-8'),
+         ('\xff\xfe\x00\x00', 'utf-32le'), ('\x00\x00\xfe\xff', 'utf-32be'),
+         ('\xff\xfe', 'utf-16le'), ('\xfe\xff', 'utf-16be'))
+
+# pattern for matching the encoding of an xml declaration
+_xmlencodingpattern = re.compile(
+    '^<\?xml[^>]*encoding=["\']([^"\']*)["\']')
+
+# pattern for matching the charset of a meta tag, either
+# <meta charset="ENCODING"> or <meta http-equiv="content-type" ...>
+_metacharsetpattern = re.compile(
+    '<\s*meta[^>]+charset=["\']?([^;"\'>\s]+)', re.I)
+
+# pattern for matching the @charset rule of a stylesheet
+_csscharsetpattern = re.compile('^@charset\s+["\']([^"\']*)["\']', re.I)
+
+# map of encoding names to whether they are supported
+_known = {}
+
+
+def is_known(encoding):
+    """Check whether the encoding is supported."""
+    try:
+        return _known[encoding]
+    except KeyError:
+        pass
+    try:
+        codecs.lookup(encoding)
+        _known[encoding] = True
+    except (LookupError, TypeError, ValueError):
+        _known[encoding] = False
+    return _known[encoding]
+
+
+def sniff(content, encoding=None):
+    """Return a (skip, encoding) tuple with the length of the byte order
+    mark and the encoding of the content. The byte order mark takes
+    precedence over the encoding from the HTTP headers which takes
+    precedence over a declaration in the first SNIFF_SIZE bytes. The
+    encoding is None if it cannot be determined this way."""
+    for bom, bom_encoding in _boms:
+        if content.startswith(bom):
+            return len(bom), bom_encoding
+    if encoding and is_known(encoding):
+        return 0, encoding
+    start = content[:SNIFF_SIZE]
+    declared = _xmlencodingpattern.search(start) or \
+               _metacharsetpattern.search(start) or \
+               _csscharsetpattern.search(start)
+    if declared:
+        declared = declared.group(1).lower()
+        # the declaration could be read so the content is not UTF-16
+        if declared.startswith(('utf-16', 'utf-32')):
+            declared = 'utf-8'
+        if is_known(declared):
+            return 0, declared
+    return 0, None
+
+
+def decode(content, encoding=None):
+    """Decode the content and return a (text, encoding) tuple. If the
+    encoding cannot be determined or the content is not valid in the
+    determined encoding, UTF-8 (or ASCII if the content is plain ASCII) is
+    used and otherwise Windows-1252."""
+    skip, encoding = sniff(content, encoding)
+    if not content:
+        return u'', encoding
+    if skip:
+        content = content[skip:]
+    if encoding:
+        try:
+            return content.decode(encoding), encoding
+        except UnicodeError:
+            pass
+    try:
+        text = content.decode('utf-8')
+    except UnicodeError:
+        return content.decode('windows-1252', 'replace'), 'windows-1252'
+    # UTF-8 sequences of non-ASCII characters are longer than one byte
+    return text, 'ascii' if len(text) == len(content) else 'utf-8'
+
+
+class StreamDecoder(object):
+    """Incremental decoding of content that is passed in chunks. The
+    encoding is chosen the same way as decode() does, based on the first
+    SNIFF_SIZE bytes. A single encoding is used for the whole content so
+    bytes in later chunks that are invalid in that encoding are replaced
+    instead of switching to another encoding halfway."""
+
+    def __init__(self, encoding=None):
+        self._http_encoding = encoding
+        self._buffer = ''
+        self._decoder = None
+        self._sniffed = None
+        self._size = self._length = 0
+        self.encoding = None
+
+    def _choose(self, data, final):
+        """Return the first encoding in which the data is valid."""
+        candidates = [self._sniffed] if self._sniffed else []
+        for encoding in candidates + ['utf-8']:
+            try:
+                codecs.getincrementaldecoder(encoding)().decode(data, final)
+                return encoding
+            except UnicodeError:
+                pass
+        return 'windows-1252'
+
+    def decode(self, data, final=False):
+        """Return the chunk of content as unicode."""
+        if self._decoder is None:
+            # collect enough content to find an encoding declaration
+            data = self._buffer + data
+            if len(data) < SNIFF_SIZE and not final:
+                self._buffer = data
+                return u''
+            self._buffer = None
+            skip, self._sniffed = sniff(data, self._http_encoding)
+            data = data[skip:]
+            if not data:
+                self.encoding = self._sniffed
+                self._decoder = codecs.getincrementaldecoder('utf-8')()
+                return u''
+            self.encoding = self._choose(data, final)
+            self._decoder = codecs.getincrementaldecoder(
+                self.encoding)('replace')
+        text = self._decoder.decode(data, final)
+        self._size += len(data)
+        self._length += len(text)
+        # report plain ASCII content as such
+        if final and self.encoding == 'utf-8' and not self._sniffed and \
+           self._size == self._length:
+            self.encoding = 'ascii'
+        return text
@@ -22,35 +22,63 @@
 
 """This modules attempts to parse CSS files.
 It currently looks for url() links in stylesheet contents and also
-looks for @import processing directives."""
+looks for @import processing directives. The stylesheet is scanned once,
+skipping comments. The encoding (including an @charset rule) is handled
+by the charset module before parsing."""
 
 mimetypes = ('text/css',)
 
 import re
-import urlparse
 
 
-# pattern for matching /* ... */ comments in css
-_commentpattern = re.compile('/\*.*?\*/', re.IGNORECASE | re.DOTALL)
+# pattern for matching /* ... */ comments, @import "url" statements and
+# url(...) in css (the url is in group 1 or 2, comments have no group)
+_tokenpattern = re.compile(
+    '/\*[\s\S]*?\*/|'
+    '@import\s+["\']([^"\']*)["\']|'
+    'url\(["\']?(.*?)["\']?\)', re.IGNORECASE)
 
-# pattern for matching @import "url" statments in css
-_importpattern = re.compile('@import\s+["\']([^"\']*)["\']',
-                            re.IGNORECASE | re.DOTALL)
+# the maximum number of style attributes of which the URLs are remembered
+_CACHE_SIZE = 10000
 
-# pattern for matching url(...) in css
-_urlpattern = re.compile('url\(["\']?(.*?)["\']?\)')
+# map of style attribute values to the URLs that they reference
+_cache = {}
 
 
-def parse(content, link, base=None):
+def _scan(content):
+    """Return the tuple of URLs (as found in the CSS) that are referenced
+    by @import statements and url()s."""
+    return tuple(match.group(match.lastindex)
+                 for match in _tokenpattern.finditer(content)
+                 if match.lastindex)
+
+
+def get_urls(content, cache=False):
+    """Return the URLs that are referenced in the CSS as they are found
+    in the content. If cache is set the found URLs are remembered which is
+    useful for style attributes that are repeated across pages."""
+    if not cache:
+        return _scan(content)
+    try:
+        return _cache[content]
+    except KeyError:
+        pass
+    if len(_cache) >= _CACHE_SIZE:
+        _cache.clear()
+    urls = _cache[content] = _scan(content)
+    return urls
+
+
+def add_embeds(link, urls):
+    """Add the URLs as embedded in the link, each URL only once."""
+    seen = set()
+    for url in urls:
+        if url not in seen:
+            seen.add(url)
+            link.add_embed(url)
+
+
+def parse(content, link):
     """Parse the specified content and extract information for crawling the
     site further."""
-    # if no base is specified, get it from the link
-    base = base or link.url
-    # strip out comments from the content
-    content = _commentpattern.sub('', content)
-    # handle @imports
-    for embed in _importpattern.findall(content):
-        link.add_embed(urlparse.urljoin(base, embed))
-    # handle url()s
-    for embed in _urlpattern.findall(content):
-        link.add_embed(urlparse.urljoin(base, embed))
+    add_embeds(link, get_urls(content))
@@ -21,14 +21,21 @@
 # under the copyright of the software, unless explicitly stated otherwise.
 
 """Parser functions for processing HTML content. This a front-end
-module that tries to load the BeatifulSoup parser first and falls
-back to loading the legacy HTMLParser parser."""
+module that tries to load the lxml parser first, then the BeautifulSoup
+parser and falls back to loading the legacy HTMLParser parser.
 
+The lxml and BeautifulSoup parsers share the rules for finding links,
+anchors and other information in the document tree in this module."""
+
+import collections
 import htmlentitydefs
 import logging
 import re
 
 from webcheck import config
+from webcheck.myurllib import normalizeurl
+from webcheck.parsers import ParseLimitError
+import webcheck.parsers.css
 
 
 logger = logging.getLogger(__name__)
@@ -71,35 +78,305 @@ def htmlunescape(txt):
     return txt
 
 
-def _parsefunction(content, link):
-    # we find a suitable parse function
-    global _parsefunction
+# pattern for matching http-equiv and content part of
+# <meta http-equiv="refresh" content="0;url=URL">
+_refreshhttpequivpattern = re.compile('^refresh$', re.I)
+_refershcontentpattern = re.compile('^[0-9]+;url=(.*)$', re.I)
+
+# patterns for matching name="author" and name="movie" attributes
+_authorpattern = re.compile('^author$', re.I)
+_moviepattern = re.compile('^movie$', re.I)
+
+
+def _has(*attrs):
+    """Return a function that checks that all the attributes are present
+    on an element."""
+    return lambda elem: all(elem.get(x) is not None for x in attrs)
+
+
+def _has_match(attr, pattern, *attrs):
+    """Return a function that checks that the attribute matches the
+    pattern and the other attributes are present."""
+    return lambda elem: bool(pattern.search(elem.get(attr) or '')) and \
+                        all(elem.get(x) is not None for x in attrs)
+
+
+# the rules for collecting elements: per tag name a list of (name, check)
+# tuples where the element is collected under name if check(element) is true
+_tagrules = {
+    'title': [('title', lambda elem: True)],
+    'base': [('base', _has('href'))],
+    'link': [('link', _has('rel', 'href'))],
+    'meta': [('author', _has_match('name', _authorpattern, 'content')),
+             ('refresh', _has_match('http-equiv', _refreshhttpequivpattern,
+                                    'content'))],
+    'img': [('img', _has('src'))],
+    'a': [('a_href', _has('href')), ('a_name', _has('name'))],
+    'frame': [('frame', _has('src'))],
+    'iframe': [('iframe', _has('src'))],
+    'object': [('object', _has('data'))],
+    'param': [('param', lambda elem: elem.get('name') == 'movie' and
+                                     elem.get('value') is not None),
+              ('movie', _has_match('name', _moviepattern, 'value'))],
+    'area': [('area', _has('href'))],
+    'applet': [('applet', _has('code'))],
+    'style': [('style', lambda elem: True)],
+    'embed': [('embed', _has('src'))],
+    'script': [('script', _has('src'))],
+    'body': [('background', _has('background'))],
+    'table': [('background', _has('background'))],
+    'td': [('background', _has('background'))],
+}
+
+
+def collect(elements, found=None):
+    """Go over the (tag name, element) tuples of the document once and
+    return a dictionary with the lists of elements per rule in _tagrules.
+    Elements with an id or style attribute are collected under 'id' and
+    'style_attr' (except anchors with a name). The elements should have a
+    get() method for looking up attributes. If found is passed the elements
+    are added to that dictionary. If the elements stop with ParseLimitError
+    the elements found so far are returned."""
+    if found is None:
+        found = collections.defaultdict(list)
     try:
-        # try BeautifulSoup parser first
-        import webcheck.parsers.html.beautifulsoup
-        logger.debug('the BeautifulSoup parser is ok')
-        _parsefunction = webcheck.parsers.html.beautifulsoup.parse
-    except ImportError:
-        # fall back to legacy HTMLParser parser
+        for name, elem in elements:
+            for rule, check in _tagrules.get(name, ()):
+                if check(elem):
+                    found[rule].append(elem)
+            if elem.get('id') is not None and \
+               not (name == 'a' and elem.get('name') is not None):
+                found['id'].append(elem)
+            if elem.get('style') is not None:
+                found['style_attr'].append(elem)
+    except ParseLimitError:
+        # the problem has been reported in the link
+        pass
+    return found
+
+
+def extract(found, link, text, unescape):
+    """Extract the URLs, anchors, title and author from the elements that
+    were collected with collect() and store them in the link. The text
+    function should return the text contents of an element (or None) and
+    unescape should return a unicode string of text or attribute values
+    with entities replaced."""
+    # <title>TITLE</title>
+    title = (found['title'] or [None])[0]
+    if title is not None and text(title):
+        link.title = unescape(text(title)).strip()
+
+    # FIXME: using normalizeurl is wrong below, we should probably use
+    #        something like link.urlunescape() to do the escaping and check
+    #        and log at the same time
+
+    # <base href="URL"> (the other URLs are resolved against this later)
+    base = (found['base'] or [None])[0]
+    if base is not None:
+        link.base = normalizeurl(unescape(base.get('href')).strip())
+    # <link rel="TYPE" href="URL">
+    for l in found['link']:
+        if l.get('rel').lower() in ('stylesheet', 'alternate stylesheet',
+                                    'icon', 'shortcut icon'):
+            embed = normalizeurl(unescape(l.get('href')).strip())
+            if embed:
+                link.add_embed(embed)
+    # <meta name="author" content="AUTHOR">
+    author = (found['author'] or [None])[0]
+    if author is not None and author.get('content'):
+        link.author = unescape(author.get('content')).strip()
+    # <meta http-equiv="refresh" content="0;url=URL">
+    refresh = (found['refresh'] or [None])[0]
+    if refresh is not None and refresh.get('content'):
+        try:
+            child = _refershcontentpattern.search(
+                refresh.get('content')).group(1)
+        except AttributeError:
+            pass  # ignore cases where refresh header parsing causes problems
+        else:
+            link.add_child(child)
+    # <img src="URL">
+    for img in found['img']:
+        embed = normalizeurl(unescape(img.get('src')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <a href="URL">
+    for a in found['a_href']:
+        child = normalizeurl(unescape(a.get('href')).strip())
+        if child:
+            link.add_child(child)
+    # <a name="NAME">
+    # TODO: consistent url escaping?
+    for a in found['a_name']:
+        # get anchor name
+        a_name = normalizeurl(unescape(a.get('name')).strip())
+        # if both id and name are used they should be the same
+        if a.get('id') is not None and \
+           a_name != normalizeurl(unescape(a.get('id')).strip()):
+            link.add_pageproblem(
+              'anchors defined in name and id attributes do not match')
+            # add the id anchor anyway
+            link.add_anchor(normalizeurl(unescape(a.get('id')).strip()))
+        # add the anchor
+        link.add_anchor(a_name)
+    # <ANY id="ID">
+    for elem in found['id']:
+        # add the anchor
+        link.add_anchor(normalizeurl(unescape(elem.get('id')).strip()))
+    # <frameset><frame src="URL"...>...</frameset>
+    for frame in found['frame']:
+        embed = normalizeurl(unescape(frame.get('src')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <iframe src="URL"...>
+    for frame in found['iframe']:
+        embed = normalizeurl(unescape(frame.get('src')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <object data="URL"...>
+    for obj in found['object']:
+        embed = normalizeurl(unescape(obj.get('data')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <object><param name="movie" value="URL"...></object>
+    for para in found['param']:
+        embed = normalizeurl(unescape(para.get('value')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <map><area href="URL"...>...</map>
+    for area in found['area']:
+        child = normalizeurl(unescape(area.get('href')).strip())
+        if child:
+            link.add_child(child)
+    # <applet code="URL" [archive="URL"]...>
+    for applet in found['applet']:
+        # if applet has archive tag check that
+        if applet.get('archive') is not None:
+            embed = normalizeurl(unescape(applet.get('archive')).strip())
+        else:
+            embed = normalizeurl(unescape(applet.get('code')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <embed src="URL"...>
+    for embedd in found['embed']:
+        embed = normalizeurl(unescape(embedd.get('src')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <embed><param name="movie" value="url"></embed>
+    for param in found['movie']:
+        embed = normalizeurl(unescape(param.get('value')).strip())
+        if embed:
+            link.add_embed(embed)
+    # delegate handling of inline css to css module
+    css = []
+    # <style>content</style>
+    for style in found['style']:
+        if text(style) and link.use_css(len(text(style))):
+            css.extend(webcheck.parsers.css.get_urls(unescape(text(style))))
+    # <ANY style="CSS"> (the same styles are often used on many pages)
+    for elem in found['style_attr']:
+        if link.use_css(len(elem.get('style'))):
+            css.extend(webcheck.parsers.css.get_urls(elem.get('style'), True))
+    webcheck.parsers.css.add_embeds(link, css)
+    # <script src="url">
+    for script in found['script']:
+        embed = normalizeurl(unescape(script.get('src')).strip())
+        if embed:
+            link.add_embed(embed)
+    # <body|table|td background="url">
+    for t in found['background']:
+        embed = normalizeurl(unescape(t.get('background')).strip())
+        if embed:
+            link.add_embed(embed)
+    # flag that the link contains a valid page
+    link.is_page = True
+
+
+# the available HTML parser modules by name in order of preference
+_backends = collections.OrderedDict([
+    ('lxml', 'lxmlparser'),
+    ('beautifulsoup', 'beautifulsoup'),
+    ('htmlparser', 'htmlparser')])
+
+
+# the selected HTML parser module
+_backend = None
+
+
+def _get_backend():
+    """Return the HTML parser module that should be used."""
+    global _backend
+    if _backend is not None:
+        return _backend
+    names = list(_backends)
+    if config.HTML_PARSER:
+        # try the configured parser first
+        names.remove(config.HTML_PARSER)
+        names.insert(0, config.HTML_PARSER)
+    for name in names:
+        try:
+            _backend = __import__('webcheck.parsers.html.' + _backends[name],
+                                  globals(), locals(), [_backends[name]])
+            break
+        except ImportError, e:
+            if name == config.HTML_PARSER:
+                logger.warn('the %s parser is unavailable: %s', name, str(e))
+    logger.debug('using the %s parser', name)
+    if name == 'htmlparser' and name != config.HTML_PARSER:
         logger.warn('falling back to the legacy HTML parser, '
-                    'consider installing BeautifulSoup')
-        import webcheck.parsers.html.htmlparser
-        _parsefunction = webcheck.parsers.html.htmlparser.parse
-    # call the actual parse function
-    _parsefunction(content, link)
+                    'consider installing lxml or BeautifulSoup')
+    return _backend
 
 
-def parse(content, link):
-    """Parse the specified content and extract an url list, a list of images a
-    title and an author. The content is assumed to contain HMTL."""
-    # call the normal parse function
-    _parsefunction(content, link)
-    # call the tidy parse function
-    if config.TIDY_OPTIONS:
+def _get_tidy():
+    """Return the tidy module if the content should be checked with tidy
+    while parsing or None otherwise."""
+    if config.TIDY_OPTIONS and config.VALIDATE == 'inline':
         try:
             import webcheck.parsers.html.calltidy
-            webcheck.parsers.html.calltidy.parse(content, link)
+            return webcheck.parsers.html.calltidy
         except ImportError:
             logger.warn('tidy library (python-utidylib) is unavailable')
             # remove config to only try once
             config.TIDY_OPTIONS = None
+
+
+def parse(content, link):
+    """Parse the specified content and extract an url list, a list of images a
+    title and an author. The content is assumed to contain HMTL."""
+    # call the normal parse function
+    _get_backend().parse(content, link)
+    # call the tidy parse function
+    tidy = _get_tidy()
+    if tidy:
+        tidy.parse(content, link)
+
+
+class _StreamParser(object):
+    """Wrapper around the incremental parser of the HTML parser module that
+    also keeps the content for tidy if needed."""
+
+    def __init__(self, parser, link, tidy):
+        self._parser = parser
+        self._link = link
+        self._tidy = tidy
+        self._chunks = []
+
+    def feed(self, data):
+        self._parser.feed(data)
+        if self._tidy:
+            self._chunks.append(data)
+
+    def close(self):
+        self._parser.close()
+        if self._tidy:
+            self._tidy.parse(''.join(self._chunks), self._link)
+
+
+def stream(link):
+    """Return an incremental parser for HTML content with feed(data) and
+    close() methods that fills in the link or None if the HTML parser
+    module does not support incremental parsing."""
+    backend = _get_backend()
+    if hasattr(backend, 'StreamParser'):
+        return _StreamParser(backend.StreamParser(link), link, _get_tidy())
@@ -26,15 +26,23 @@ from webcheck import config
 from webcheck.parsers.html import htmlunescape
 
 
+def check(content, encoding=None):
+    """Return the list of problems that tidy finds in the content."""
+    # force encoding of the content to UTF-8
+    if isinstance(content, unicode):
+        content = content.encode('utf-8')
+    elif encoding:
+        content = content.decode(encoding).encode('utf-8')
+    t = tidy.parseString(content, **config.TIDY_OPTIONS)
+    # error messages are escaped so we unescape them
+    return [htmlunescape(unicode(str(err), 'utf-8', 'replace'))
+            for err in t.errors]
+
+
 def parse(content, link):
     """Parse the specified content with tidy and add any errors to the
     link."""
     # only call tidy on internal pages
     if link.is_internal:
-        # force encoding of the content to UTF-8
-        if link.encoding:
-            content = content.decode(link.encoding).encode('utf-8')
-        t = tidy.parseString(content, **config.TIDY_OPTIONS)
-        for err in t.errors:
-            # error messages are escaped so we unescape them
-            link.add_pageproblem(htmlunescape(unicode(str(err), 'utf-8', 'replace')))
+        for problem in check(content, link.encoding):
+            link.add_pageproblem(problem)
@@ -28,9 +28,9 @@ will only handle properly formatted HTML."""
 import HTMLParser
 import logging
 import re
-import urlparse
 
 from webcheck.myurllib import normalizeurl
+from webcheck.parsers import ParseLimitError
 from webcheck.parsers.html import htmlunescape
 import webcheck.parsers.css
 
@@ -44,12 +44,6 @@ _charentitypattern = re.compile('&#([0-9]{1,3});')
 # pattern for matching spaces
 _spacepattern = re.compile(' ')
 
-# pattern for matching charset declaration for http-equiv tag
-_charsetpattern = re.compile('charset=([^ ]*)', re.I)
-
-# pattern for matching the encoding part of an xml declaration
-_encodingpattern = re.compile('^xml .*encoding="([^"]*)"', re.I)
-
 
 class _MyHTMLParser(HTMLParser.HTMLParser):
     """A simple subclass of HTMLParser.HTMLParser continuing after errors
@@ -66,6 +60,7 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
         self.embedded = []
         self.children = []
         self.anchors = []
+        self.css = []
         self.errmsg = None
         self.errcount = 0
         HTMLParser.HTMLParser.__init__(self)
@@ -89,7 +84,7 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
             self.link.add_pageproblem(
               what + ' contains unescaped spaces: ' + url + ', ' + self._location())
         # replace &#nnn; entity refs with proper characters
-        url = _charentitypattern.sub(lambda x: chr(int(x.group(1))), url)
+        url = _charentitypattern.sub(lambda x: unichr(int(x.group(1))), url)
         return normalizeurl(url)
 
     def error(self, message):
@@ -115,6 +110,7 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
 
     def handle_starttag(self, tag, attrs):
         """Handle start tags in html."""
+        self.link.count_element()
         # turn attrs into hash
         attrs = dict(attrs)
         # <title>TITLE</title>
@@ -134,13 +130,6 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
         # <meta http-equiv="refresh" content="0;url=URL">
         elif tag == 'meta' and 'http-equiv' in attrs and 'content' in attrs and attrs['http-equiv'].lower() == 'refresh':
             pass  # TODO: implement
-        # <meta http-equiv="content-type" content="text/html; charset=utf-8" />
-        elif tag == 'meta' and 'http-equiv' in attrs and 'content' in attrs and attrs['http-equiv'].lower() == 'content-type':
-            try:
-                self.link.set_encoding(_charsetpattern.search(attrs['content']).group(1))
-            except AttributeError:
-                # ignore cases where encoding is not set in header
-                pass
         # <img src="url">
         elif tag == 'img' and 'src' in attrs:
             self.embedded.append(self._cleanurl(attrs['src']))
@@ -213,18 +202,21 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
         elif tag in ('body', 'table', 'td') and 'background' in attrs:
             self.embedded.append(self._cleanurl(attrs['background']))
         # pick up any tags with a style attribute
-        if 'style' in attrs:
-            # delegate handling of inline css to css module
-            webcheck.parsers.css.parse(attrs['style'], self.link, self.base)
+        if 'style' in attrs and self.link.use_css(len(attrs['style'])):
+            # delegate handling of inline css to css module (the same
+            # styles are often used on many pages)
+            self.css.extend(webcheck.parsers.css.get_urls(
+                attrs['style'], True))
 
     def handle_endtag(self, tag):
         """Handle end tags in html."""
         if tag == 'title' and self.title is None:
             self.title = self.collect
             self.collect = None
-        elif tag == 'style' and self.collect is not None:
+        elif tag == 'style' and self.collect is not None and \
+             self.link.use_css(len(self.collect)):
             # delegate handling of inline css to css module
-            webcheck.parsers.css.parse(self.collect, self.link, self.base)
+            self.css.extend(webcheck.parsers.css.get_urls(self.collect))
 
     def handle_data(self, data):
         """Collect data if we were collecting data."""
@@ -243,64 +235,77 @@ class _MyHTMLParser(HTMLParser.HTMLParser):
         self.handle_data('&' + name + ';')
         # TODO: do not pass ; if plain text does not contain it?
 
-    def handle_pi(self, data):
-        """Handle xml declaration."""
-        # find character encoding from declaration
-        try:
-            self.link.set_encoding(_encodingpattern.search(data).group(1))
-        except AttributeError:
-            pass
 
+class StreamParser(object):
+    """Incremental parser that processes the content as it is fed in
+    chunks."""
 
-def _maketxt(txt, encoding):
-    """Return an unicode text of the specified string do correct character
-    conversions and replacing html entities with normal characters."""
-    # try to decode with the given encoding
-    if encoding:
+    def __init__(self, link):
+        self.link = link
+        self._parser = _MyHTMLParser(link)
+        self._failed = False
+
+    def feed(self, data):
+        """Parse the next chunk of content."""
+        if self._failed:
+            return
         try:
-            return htmlunescape(txt.decode(encoding))
-        except (LookupError, TypeError, ValueError), e:
-            logger.warn('page has unknown encoding: %s', str(encoding))
-    # fall back to locale's encoding
-    return htmlunescape(txt.decode('ascii', 'replace'))
+            self._parser.feed(data)
+        except ParseLimitError:
+            # keep what was found so far
+            self._failed = True
+        except Exception, e:
+            # ignore (but log) all errors
+            logger.exception('caught exception: %s', str(e))
+            self._failed = True
+
+    def close(self):
+        """Finish parsing and store the found information in the link."""
+        parser = self._parser
+        link = self.link
+        if not self._failed:
+            try:
+                parser.close()
+            except ParseLimitError:
+                pass
+            except Exception, e:
+                # ignore (but log) all errors
+                logger.exception('caught exception: %s', str(e))
+        # check for parser errors
+        if parser.errmsg is not None:
+            logger.debug('problem parsing html: %s', parser.errmsg)
+            link.add_pageproblem('problem parsing html: %s' % parser.errmsg)
+        # dump encoding
+        logger.debug('html encoding: %s', str(link.encoding))
+        # flag that the link contains a valid page
+        link.is_page = True
+        # save the title
+        if parser.title is not None:
+            link.title = htmlunescape(parser.title).strip()
+        # save the author
+        if parser.author is not None:
+            link.author = htmlunescape(parser.author).strip()
+        # the base of the document (for resolving the other urls)
+        if parser.base is not None:
+            link.base = parser.base
+        # list embedded and children
+        for embed in parser.embedded:
+            if embed:
+                link.add_embed(embed)
+        for child in parser.children:
+            if child:
+                link.add_child(child)
+        # add the urls found in inline css, each only once
+        webcheck.parsers.css.add_embeds(link, parser.css)
+        # list anchors
+        for anchor in parser.anchors:
+            if anchor:
+                link.add_anchor(anchor)
+
 
 def parse(content, link):
     """Parse the specified content and extract an url list, a list of images a
     title and an author. The content is assumed to contain HMTL."""
-    # create parser and feed it the content
-    parser = _MyHTMLParser(link)
-    try:
-        parser.feed(content.decode('ascii', 'ignore').encode())
-        parser.close()
-    except Exception, e:
-        # ignore (but log) all errors
-        logger.exception('caught exception: %s', str(e))
-    # check for parser errors
-    if parser.errmsg is not None:
-        logger.debug('problem parsing html: %s', parser.errmsg)
-        link.add_pageproblem('problem parsing html: %s' % parser.errmsg)
-    # dump encoding
-    logger.debug('html encoding: %s', str(link.encoding))
-    # flag that the link contains a valid page
-    link.is_page = True
-    # save the title
-    if parser.title is not None:
-        link.title = _maketxt(parser.title, link.encoding).strip()
-    # save the author
-    if parser.author is not None:
-        link.author = _maketxt(parser.author, link.encoding).strip()
-    # figure out the base of the document (for building the other urls)
-    base = link.url
-    if parser.base is not None:
-        base = parser.base
-    # list embedded and children
-    for embed in parser.embedded:
-        if embed:
-            link.add_embed(urlparse.urljoin(base, embed))
-    for child in parser.children:
-        if child:
-            link.add_child(urlparse.urljoin(base, child))
-    # list anchors
-    for anchor in parser.anchors:
-        if anchor:
-            link.add_anchor(anchor)
+    parser = StreamParser(link)
+    parser.feed(content)
+    parser.close()
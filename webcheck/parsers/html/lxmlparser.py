@@ -0,0 +1,142 @@
+
+# lxmlparser.py - parser functions for html content using lxml
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Parser functions for processing HTML content. This module uses the
+HTML parser of lxml which is a lot faster than BeautifulSoup because the
+parsing is done by libxml2. The content is always parsed incrementally
+with the StreamParser class so parsing stops early when a limit for the
+document is reached."""
+
+import lxml.etree
+
+from webcheck.parsers.html import collect, extract
+
+
+# the number of characters of a complete document that are passed to the
+# parser at a time
+_CHUNK_SIZE = 64 * 1024
+
+# the maximum number of characters after an unfinished tag that are held
+# back before passing them to the parser anyway
+_MAX_PENDING = 64 * 1024
+
+
+def _text(elem):
+    """Return the text contents of the element if it has no child
+    elements."""
+    if not len(elem):
+        return elem.text
+
+
+def _unicode(value):
+    """Return the value as a unicode string (lxml already replaced the
+    entities)."""
+    return unicode(value or '')
+
+
+def parse(content, link):
+    """Parse the specified content and extract an url list, a list of images a
+    title and an author. The content is assumed to contain HMTL."""
+    parser = StreamParser(link)
+    for pos in xrange(0, len(content), _CHUNK_SIZE):
+        # the rest of the content is ignored when a limit was reached
+        if link.stopped:
+            break
+        parser.feed(content[pos:pos + _CHUNK_SIZE])
+    parser.close()
+
+
+class _Element(dict):
+    """The attributes and text of an element that are kept after the
+    element itself has been discarded."""
+
+    text = None
+
+
+class StreamParser(object):
+    """Incremental parser that finds the links and other information while
+    the content is fed in chunks. Elements are discarded as soon as they
+    have been handled so the memory use does not depend on the size of the
+    document."""
+
+    def __init__(self, link):
+        self.link = link
+        self._parser = lxml.etree.HTMLPullParser(
+            events=('start', 'end'), encoding='utf-8')
+        self._found = None
+        self._started = False
+        # content after the last unfinished tag
+        self._pending = ''
+        # map of elements to copies for which the text is needed
+        self._needtext = {}
+
+    def _elements(self):
+        """Return (tag name, element) tuples for the elements that were
+        parsed so far."""
+        for event, elem in self._parser.read_events():
+            if not isinstance(elem.tag, basestring):
+                continue
+            if event == 'start':
+                self.link.count_element()
+                copy = _Element(elem.attrib)
+                if elem.tag in ('title', 'style'):
+                    self._needtext[elem] = copy
+                yield elem.tag, copy
+            else:
+                copy = self._needtext.pop(elem, None)
+                if copy is not None:
+                    copy.text = _text(elem)
+                # discard the element and the siblings that came before it
+                elem.clear()
+                parent = elem.getparent()
+                if parent is not None:
+                    while elem.getprevious() is not None:
+                        del parent[0]
+
+    def feed(self, data):
+        """Parse the next chunk of content."""
+        data = self._pending + data
+        # libxml2 loses track of the end of script and style elements if
+        # the end tag is split over chunks so do not pass unfinished tags
+        # (a stray < would otherwise hold back the rest of the document)
+        pos = data.rfind('<')
+        if pos >= 0 and data.find('>', pos) < 0 and \
+           len(data) - pos <= _MAX_PENDING:
+            data, self._pending = data[:pos], data[pos:]
+        else:
+            self._pending = ''
+        if data:
+            self._started = True
+            self._parser.feed(data.encode('utf-8'))
+            self._found = collect(self._elements(), self._found)
+
+    def close(self):
+        """Finish parsing and store the found information in the link."""
+        if self._pending:
+            self._started = True
+            self._parser.feed(self._pending.encode('utf-8'))
+        # an empty document has no elements
+        if self._started:
+            self._parser.close()
+        self._found = collect(self._elements(), self._found)
+        # go over the elements once to find links and other information
+        extract(self._found, self.link, lambda elem: elem.text, _unicode)
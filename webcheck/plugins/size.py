@@ -34,23 +34,27 @@ from webcheck.output import render
 
 
 def get_size(link, seen=None):
-    """Return the size of the link and all its embedded links, counting each
-    link only once."""
+    """Return the number of bytes that are transferred when downloading the
+    link and all its embedded links, counting each link only once. This
+    also sets the total_size property to the uncompressed size."""
     # make a new list
     if seen is None:
         seen = set()
     # add this link to the list
     seen.add(link)
     # if we don't known about our total size yet, calculate
-    if not hasattr(link, 'total_size'):
+    if not hasattr(link, 'total_transfer_size'):
         # add our size
-        size = link.size or 0
+        size = link.size or link.transfer_size or 0
+        transfer_size = link.transfer_size or size
         # add sizes of embedded objects
         for embed in link.embedded:
             if embed not in seen:
-                size += get_size(embed, seen)
+                transfer_size += get_size(embed, seen)
+                size += embed.total_size
         link.total_size = size
-    return link.total_size
+        link.total_transfer_size = transfer_size
+    return link.total_transfer_size
 
 
 def generate(crawler):
@@ -59,7 +63,7 @@ def generate(crawler):
     links = session.query(Link).filter_by(is_page=True, is_internal=True)
     links = [x for x in links
              if get_size(x) >= config.REPORT_SLOW_URL_SIZE * 1024]
-    links.sort(lambda a, b: cmp(b.total_size, a.total_size))
+    links.sort(lambda a, b: cmp(b.total_transfer_size, a.total_transfer_size))
     render(__outputfile__, crawler=crawler, title=__title__,
            links=links)
     session.close()
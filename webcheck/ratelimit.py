@@ -0,0 +1,154 @@
+
+# ratelimit.py - limit the rate of requests per host
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Rate limiting of requests. The time between requests is limited per host
+so waiting for one host does not hold up the retrieval of URLs from other
+hosts. Optionally the total bandwidth that is used can be limited."""
+
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Token bucket that is filled with rate tokens per second up to
+    capacity tokens. Taking more tokens than are available puts the bucket
+    in debt which has to be paid off before new tokens are available."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.time()
+
+    def _fill(self):
+        now = time.time()
+        self._tokens = min(self.capacity,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount=1):
+        """Return the number of seconds until amount tokens are
+        available."""
+        self._fill()
+        return max(0, (amount - self._tokens) / self.rate)
+
+    def take(self, amount=1):
+        """Take the tokens from the bucket."""
+        self._fill()
+        self._tokens -= amount
+
+
+class RateLimiter(object):
+    """Keep track of when requests to hosts may be made. Hosts are
+    identified by (scheme, netloc) tuples.
+
+    Each host gets a bucket that holds a single token that is refilled after
+    delay seconds (the largest of the default delay and the delay that was
+    configured for the host). Hosts without a delay are only limited when a
+    server asked to back off. If bandwidth is set the amount of data that is
+    transferred is limited to bandwidth bytes per second."""
+
+    def __init__(self, delay=0, bandwidth=None):
+        self.delay = delay or 0
+        self._lock = threading.Lock()
+        # map of host to configured delay
+        self._delays = {}
+        # map of host to token bucket
+        self._buckets = {}
+        # map of host to time until which the host should be left alone
+        self._blocked = {}
+        self._bandwidth = None
+        if bandwidth:
+            self._bandwidth = TokenBucket(bandwidth, bandwidth)
+
+    def get_delay(self, location):
+        """Return the minimum number of seconds between requests."""
+        return max(self.delay, self._delays.get(location, 0))
+
+    def set_delay(self, location, delay):
+        """Configure the delay for the host (e.g. from robots.txt)."""
+        with self._lock:
+            self._delays[location] = delay
+            self._buckets.pop(location, None)
+        logger.debug('using a delay of %s seconds for %s',
+                     self.get_delay(location), '://'.join(location))
+
+    def _get_bucket(self, location):
+        """Return the token bucket for the host (called with the lock
+        held)."""
+        bucket = self._buckets.get(location)
+        if bucket is None:
+            bucket = self._buckets[location] = TokenBucket(
+                1.0 / self.get_delay(location), 1)
+        return bucket
+
+    def _ready_in(self, location):
+        """Return the number of seconds until a request to the host may be
+        made (called with the lock held)."""
+        wait = max(0, self._blocked.get(location, 0) - time.time())
+        if self.get_delay(location):
+            wait = max(wait, self._get_bucket(location).wait_time())
+        return wait
+
+    def ready_in(self, location):
+        """Return the number of seconds until a request to the host may be
+        made."""
+        with self._lock:
+            return self._ready_in(location)
+
+    def wait(self, location):
+        """Wait until a request to the host may be made and register the
+        request."""
+        while True:
+            with self._lock:
+                wait = self._ready_in(location)
+                if wait <= 0:
+                    if self.get_delay(location):
+                        self._get_bucket(location).take()
+                    return
+            logger.debug('sleeping %.2f seconds before contacting %s',
+                         wait, '://'.join(location))
+            time.sleep(wait)
+
+    def backoff(self, location, seconds):
+        """Do not make requests to the host for the specified number of
+        seconds."""
+        logger.debug('backing off from %s for %s seconds',
+                     '://'.join(location), seconds)
+        with self._lock:
+            self._blocked[location] = max(self._blocked.get(location, 0),
+                                          time.time() + seconds)
+
+    def throttle(self, size):
+        """Register the transfer of size bytes and sleep if the bandwidth
+        limit has been reached."""
+        if self._bandwidth is None:
+            return
+        with self._lock:
+            self._bandwidth.take(size)
+            wait = self._bandwidth.wait_time(0)
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,111 @@
+
+# validator.py - validation of HTML pages in background processes
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Validation of HTML pages with tidy in background processes. Checking
+a page with tidy takes much longer than finding the links on it so this
+is done separately from crawling. The problems that are found are added
+to the pages when the results come in."""
+
+import imp
+import logging
+import multiprocessing
+
+from webcheck import config
+from webcheck.workers import WorkerPool
+
+
+logger = logging.getLogger(__name__)
+
+
+def _check(content, encoding):
+    """Return the list of problems with the page (run in a worker
+    process)."""
+    import webcheck.parsers.html.calltidy
+    try:
+        return webcheck.parsers.html.calltidy.check(content, encoding)
+    except Exception, e:
+        logger.exception('problem validating page: %s', str(e))
+        return ['problem validating page: %s' % str(e)]
+
+
+class ValidatorPool(object):
+    """Pool of worker processes that validate pages while crawling
+    continues."""
+
+    def __init__(self, processes=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self._pool = WorkerPool(self.processes)
+
+    def has_room(self):
+        """Whether another page can be submitted without needlessly
+        keeping pages in memory."""
+        return self._pool.active() < self.processes * 2
+
+    def active(self):
+        """The number of pages for which the results have not been
+        collected."""
+        return self._pool.active()
+
+    def submit(self, key, content, encoding=None):
+        """Queue the page for validation. The key is returned with the
+        problems that were found."""
+        self._pool.submit(key, _check, content, encoding)
+
+    def get(self, wait=True):
+        """Return a (key, problems) tuple or None if wait is not set and
+        no results are available. If the worker process died while
+        validating the page this is reported as a problem."""
+        result = self._pool.get(wait)
+        if result is None:
+            return None
+        key, problems, problem = result
+        if problem is not None:
+            problems = ['problem validating page: %s' % problem]
+        return key, problems
+
+    def results(self, wait=False):
+        """Return (key, problems) tuples for the pages that have been
+        validated. If wait is set this waits for all pages to be
+        validated."""
+        while self.active():
+            result = self.get(wait)
+            if result is None:
+                break
+            yield result
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.close()
+
+
+def get_validator():
+    """Return a ValidatorPool if pages should be validated in the
+    background or None otherwise."""
+    if config.VALIDATE != 'background' or not config.TIDY_OPTIONS:
+        return None
+    # the tidy module is only imported by the worker processes
+    try:
+        imp.find_module('tidy')
+    except ImportError:
+        logger.warn('tidy library (python-utidylib) is unavailable')
+        return None
+    return ValidatorPool(config.VALIDATE_PROCESSES)
@@ -0,0 +1,155 @@
+
+# workers.py - pool of worker processes that keeps track of jobs
+#
+# Copyright (C) 2013 Arthur de Jong
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# The files produced as output from the software do not automatically fall
+# under the copyright of the software, unless explicitly stated otherwise.
+
+"""Pool of worker processes that keeps track of the submitted jobs. A job
+of which the worker process died (e.g. because it crashed on a bad
+document or was killed when running out of memory) or that raised an
+exception is reported as failed instead of being waited for forever."""
+
+import logging
+import multiprocessing
+import multiprocessing.queues
+import os
+import signal
+import threading
+import Queue
+
+
+logger = logging.getLogger(__name__)
+
+
+# the queue on which the worker processes report the jobs they start
+_started = None
+
+
+def _init_worker(started):
+    """Set up a worker process of the WorkerPool."""
+    global _started
+    _started = started
+    # the main process handles KeyboardInterrupt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _run(job_id, function, args):
+    """Report that the job is started and run it (in a worker process)."""
+    _started.put((job_id, os.getpid()))
+    return function(*args)
+
+
+class WorkerPool(object):
+    """Pool of worker processes that run functions. The get() method
+    returns (key, result, problem) tuples where the key is the one that
+    was passed to submit(). If the job failed the result is None and
+    problem describes what went wrong."""
+
+    def __init__(self, processes):
+        self.processes = processes
+        # the reports of started jobs are written synchronously so they
+        # are not lost if the worker process dies
+        self._started = multiprocessing.queues.SimpleQueue()
+        self._pool = multiprocessing.Pool(processes, _init_worker,
+                                          (self._started, ))
+        self._lock = threading.Lock()
+        self._counter = 0
+        # map of job ids to (key, AsyncResult) tuples of jobs that have not
+        # been collected (the AsyncResult is None if a problem was reported)
+        self._jobs = {}
+        # map of job ids to the worker processes that run them
+        self._pids = {}
+        self._results = Queue.Queue()
+
+    def active(self):
+        """The number of jobs that have not been collected with get()."""
+        with self._lock:
+            return len(self._jobs)
+
+    def ready(self):
+        """Whether get() will return without waiting."""
+        return not self._results.empty()
+
+    def submit(self, key, function, *args):
+        """Queue the function to be called with the arguments in a worker
+        process. The key is returned with the result."""
+        with self._lock:
+            self._counter += 1
+            job_id = self._counter
+            self._jobs[job_id] = key, self._pool.apply_async(
+                _run, (job_id, function, args),
+                callback=lambda result: self._results.put(
+                    (job_id, result, None)))
+
+    def _check(self):
+        """Report the jobs that raised an exception or of which the worker
+        process died. Returns whether any jobs were reported."""
+        while not self._started.empty():
+            job_id, pid = self._started.get()
+            self._pids[job_id] = pid
+        # the pool replaces worker processes that exited
+        alive = set(process.pid for process in self._pool._pool
+                    if process.exitcode is None)
+        reported = False
+        with self._lock:
+            for job_id, (key, result) in self._jobs.items():
+                if result is None or \
+                   (result.ready() and result.successful()):
+                    continue
+                if result.ready():
+                    try:
+                        result.get()
+                    except Exception, e:
+                        problem = str(e)
+                elif job_id in self._pids and self._pids[job_id] not in alive:
+                    problem = 'worker process died'
+                else:
+                    continue
+                logger.error('job %d failed: %s', job_id, problem)
+                self._jobs[job_id] = key, None
+                self._pids.pop(job_id, None)
+                self._results.put((job_id, None, problem))
+                reported = True
+        return reported
+
+    def get(self, wait=True):
+        """Return a (key, result, problem) tuple for a submitted job. If
+        wait is set this waits for a job to finish, otherwise None is
+        returned if no results are available."""
+        while True:
+            try:
+                # wait with a timeout to keep KeyboardInterrupt working
+                job_id, result, problem = self._results.get(wait, 1)
+            except Queue.Empty:
+                if self._check():
+                    continue
+                if not wait:
+                    return None
+                continue
+            with self._lock:
+                job = self._jobs.pop(job_id, None)
+                self._pids.pop(job_id, None)
+            # ignore results of jobs that were already reported as failed
+            if job is not None:
+                return job[0], result, problem
+
+    def close(self):
+        """Stop the worker processes."""
+        self._pool.terminate()
+        self._pool.join()